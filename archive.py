@@ -0,0 +1,210 @@
+# archive.py
+import hashlib
+import io
+import os
+import tarfile
+import time
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+# Audio is already compressed, so deflating it only costs CPU
+STORED_EXTENSIONS = ('.mp3',)
+
+
+class RangeNotSatisfiable(ValueError):
+    """A well-formed Range that starts past the end of the archive"""
+
+
+class ArchiveEntry:
+    """A file to include in an archive, with its size and mtime taken up front
+    so the archive layout is fixed before streaming starts.
+
+    Entries are read from `path` unless a `reader(start, end)` yielding the
+    bytes in that range is given, e.g. for objects in a bucket. Size and mtime
+    are taken from `path` if not given.
+    """
+
+    __slots__ = ('name', 'path', 'size', 'mtime', 'reader')
+
+    def __init__(self, name, path=None, size=None, mtime=None, reader=None):
+        if size is None or mtime is None:
+            stat = os.stat(path)
+            size, mtime = stat.st_size, stat.st_mtime
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime = int(mtime)
+        self.reader = reader
+
+
+def archive_etag(entries):
+    """ETag that changes whenever any file in the archive changes"""
+    digest = hashlib.sha1()
+    for entry in entries:
+        digest.update(f"{entry.name}\0{entry.size}\0{entry.mtime}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _tar_segments(entries):
+    """Lay out a tar archive as (length, header bytes or entry) segments"""
+    for entry in entries:
+        info = tarfile.TarInfo(entry.name)
+        info.size = entry.size
+        info.mtime = entry.mtime
+        info.mode = 0o644
+        header = info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8', errors='surrogateescape')
+        yield len(header), header
+        yield entry.size, entry
+        padding = -entry.size % BLOCK_SIZE
+        if padding:
+            yield padding, bytes(padding)
+    # Two empty blocks mark the end of the archive
+    yield 2 * BLOCK_SIZE, bytes(2 * BLOCK_SIZE)
+
+
+def tar_size(entries):
+    """Exact size in bytes of the tar archive of `entries`"""
+    return sum(length for length, _ in _tar_segments(entries))
+
+
+def _read_file(entry, start, end):
+    """Read bytes [start, end) of an entry, zero-filled if the file shrank and
+    cut short if it grew"""
+    remaining = end - start
+    if entry.reader is not None:
+        for chunk in entry.reader(start, end):
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+            if remaining <= 0:
+                break
+    else:
+        with open(entry.path, 'rb') as f:
+            f.seek(start)
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    if remaining > 0:
+        yield bytes(remaining)
+
+
+def stream_tar(entries, start=0, end=None):
+    """Yield bytes [start, end) of the tar archive of `entries`.
+
+    Headers and padding are generated on the fly and file contents are read in
+    chunks, so memory use doesn't depend on the archive size and any byte range
+    can be produced without building what comes before it.
+    """
+    if end is None:
+        end = tar_size(entries)
+
+    offset = 0
+    for length, segment in _tar_segments(entries):
+        segment_start, segment_end = offset, offset + length
+        offset = segment_end
+        if segment_end <= start:
+            continue
+        if segment_start >= end:
+            return
+
+        lo = max(start, segment_start) - segment_start
+        hi = min(end, segment_end) - segment_start
+        if isinstance(segment, ArchiveEntry):
+            yield from _read_file(segment, lo, hi)
+        else:
+            yield segment[lo:hi]
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Write-only stream that collects what ZipFile writes so it can be yielded"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """Yield a zip archive of `entries` as it is written.
+
+    ZipFile writes data descriptors after each member when the output isn't
+    seekable, so nothing has to be buffered beyond the current chunk. Zip
+    archives can't be resumed with a Range request, use tar for that.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zf:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, date_time=_zip_date_time(entry.mtime))
+            info.compress_type = (zipfile.ZIP_STORED if entry.name.endswith(STORED_EXTENSIONS)
+                                  else zipfile.ZIP_DEFLATED)
+            info.file_size = entry.size
+            with zf.open(info, 'w', force_zip64=entry.size > 0x7FFFFFFF) as member:
+                for chunk in _read_file(entry, 0, entry.size):
+                    member.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    data = buffer.drain()
+    if data:
+        yield data
+
+
+def _zip_date_time(mtime):
+    # Zip timestamps can't go before 1980
+    return time.localtime(max(mtime, 315532800))[:6]
+
+
+def parse_range(range_header, total_size):
+    """Parse a single `bytes=start-end` Range header into [start, end).
+
+    Returns None if the header is missing or malformed, in which case it
+    should be ignored, and raises RangeNotSatisfiable if it is well formed
+    but selects no bytes of the archive.
+    """
+    if not range_header or not range_header.startswith('bytes='):
+        return None
+    spec = range_header[len('bytes='):].strip()
+    if ',' in spec or '-' not in spec:
+        return None
+
+    first, last = spec.split('-', 1)
+    if not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+    if first:
+        start = int(first)
+        end = int(last) + 1 if last else total_size
+        if last and end <= start:
+            # A last byte before the first one makes the range invalid, not unsatisfiable
+            return None
+    else:
+        # Suffix range: the last N bytes
+        start = max(total_size - int(last), 0)
+        end = total_size
+
+    end = min(end, total_size)
+    if start >= end:
+        raise RangeNotSatisfiable(range_header)
+    return start, end
@@ -0,0 +1,132 @@
+# audio_stream.py
+import os
+import threading
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+
+
+class AudioGeneration:
+    """One in-progress audio generation.
+
+    A background thread writes the upstream chunks to a temporary file next to
+    the final path and moves it into place once the stream completes. Listeners
+    read the temporary file from the start and then follow it as it grows, so
+    anyone who joins late still gets the whole file.
+    """
+
+    def __init__(self, audio_path, chunks, on_complete=None):
+        self.audio_path = audio_path
+        self.temp_path = f"{audio_path}.{uuid.uuid4().hex}.part"
+        self.size = 0
+        self.done = False
+        self.error = None
+        self._on_complete = on_complete
+        self._cond = threading.Condition()
+        # Created before the thread starts so listeners can always open it
+        self._file = open(self.temp_path, 'wb')
+        self._thread = threading.Thread(target=self._run, args=(chunks,), daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self, chunks):
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                self._file.write(chunk)
+                self._file.flush()
+                with self._cond:
+                    self.size += len(chunk)
+                    self._cond.notify_all()
+            self._file.close()
+
+            # Promote the finished file into the cache atomically
+            with self._cond:
+                os.replace(self.temp_path, self.audio_path)
+                self.done = True
+                self._cond.notify_all()
+            print(f"Audio generation complete for {self.audio_path}. Total size: {self.size} bytes")
+        except Exception as e:
+            print(f"Audio generation error for {self.audio_path}: {e}")
+            self._file.close()
+            with self._cond:
+                self.error = e
+                self.done = True
+                if os.path.exists(self.temp_path):
+                    os.remove(self.temp_path)
+                self._cond.notify_all()
+        finally:
+            if self._on_complete:
+                self._on_complete(self)
+
+    def listen(self):
+        """Yield the audio from the first byte, waiting for more until the generation ends"""
+        with self._cond:
+            # A failed generation's temp file is already gone
+            if self.error:
+                raise self.error
+            # Open under the lock so the file can't be renamed or removed in between
+            f = open(self.audio_path if self.done else self.temp_path, 'rb')
+
+        with f:
+            offset = 0
+            while True:
+                with self._cond:
+                    while offset >= self.size and not self.done:
+                        self._cond.wait()
+                    available = self.size - offset
+                    error = self.error
+
+                if available <= 0:
+                    if error:
+                        raise error
+                    return
+
+                chunk = f.read(min(CHUNK_SIZE, available))
+                if not chunk:
+                    return
+                offset += len(chunk)
+                yield chunk
+
+
+class AudioBroadcaster:
+    """Tracks in-progress generations so concurrent listeners share one upstream stream.
+
+    `on_saved(audio_path)` is called once a generation's file is in place.
+    """
+
+    def __init__(self, on_saved=None):
+        self.on_saved = on_saved
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def is_generating(self, audio_path):
+        with self._lock:
+            return audio_path in self._active
+
+    def get(self, audio_path):
+        with self._lock:
+            return self._active.get(audio_path)
+
+    def start(self, audio_path, chunk_factory):
+        """Return the in-progress generation for `audio_path`, starting one from
+        `chunk_factory()` if there is none"""
+        with self._lock:
+            generation = self._active.get(audio_path)
+            if generation is None:
+                generation = AudioGeneration(audio_path, chunk_factory(), self._finished)
+                self._active[audio_path] = generation
+                generation.start()
+            return generation
+
+    def _finished(self, generation):
+        if self.on_saved and not generation.error:
+            try:
+                self.on_saved(generation.audio_path)
+            except Exception as e:
+                print(f"Could not save audio {generation.audio_path}: {e}")
+        with self._lock:
+            if self._active.get(generation.audio_path) is generation:
+                del self._active[generation.audio_path]
@@ -0,0 +1,281 @@
+# concurrency.py
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Exceptions that mean YouTube is throttling or blocking us rather than that the
+# video itself has no transcript. Matched by name because the exception classes
+# differ between youtube-transcript-api releases. YouTubeRequestFailed is raised
+# for any HTTP error, so it is classified by its status code instead.
+THROTTLE_ERRORS = {'TooManyRequests', 'RequestBlocked', 'IpBlocked'}
+THROTTLE_STATUS_CODES = {429}
+THROTTLE_MESSAGES = ('too many requests', 'blocking requests from your ip')
+
+# requests formats HTTP errors as "429 Client Error: Too Many Requests for url: ..."
+HTTP_ERROR_RE = re.compile(r'\b([45]\d\d) (?:Client|Server) Error\b')
+
+# Longest a run waits for another job's probe before checking the breaker again
+PROBE_WAIT = 1.0
+
+
+def error_class(exc):
+    """Name of an exception's class, as recorded on failed jobs"""
+    return type(exc).__name__
+
+
+def status_code(exc):
+    """HTTP status code behind an exception, or None if it has none"""
+    response = getattr(exc, 'response', None)
+    if getattr(response, 'status_code', None) is not None:
+        return response.status_code
+    # googleapiclient's HttpError
+    resp = getattr(exc, 'resp', None)
+    if getattr(resp, 'status', None) is not None:
+        return int(resp.status)
+    # youtube-transcript-api only keeps the message of the requests error
+    match = HTTP_ERROR_RE.search(str(exc))
+    return int(match.group(1)) if match else None
+
+
+def is_throttle_error(exc):
+    """Check whether an exception means we're being rate limited or blocked"""
+    if error_class(exc) in THROTTLE_ERRORS:
+        return True
+    status = status_code(exc)
+    if status is not None:
+        return status in THROTTLE_STATUS_CODES
+    message = str(exc).lower()
+    return any(pattern in message for pattern in THROTTLE_MESSAGES)
+
+
+# Outcomes of a request made under the AdaptiveLimiter
+SUCCESS = 'success'
+THROTTLED = 'throttled'
+SKIPPED = 'skipped'
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit.
+
+    Every success grows the limit by 1/limit, so it climbs by about one slot per
+    round of successful requests. A throttled request halves it, at most once
+    per `decrease_interval` so a burst of failures from the same round only
+    counts once.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, backoff=0.5, decrease_interval=1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.decrease_interval = decrease_interval
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, outcome=SUCCESS):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome == THROTTLED:
+                if now - self._last_decrease >= self.decrease_interval:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = now
+            elif outcome == SUCCESS:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot for one request. Set `.outcome` on the yielded slot to
+        THROTTLED if the request was rate limited, or SKIPPED if it was never made."""
+        slot = _Slot()
+        self.acquire()
+        try:
+            yield slot
+        finally:
+            self.release(slot.outcome)
+
+    def stats(self):
+        with self._cond:
+            return {'limit': round(self.limit, 2), 'in_flight': self.in_flight}
+
+
+class _Slot:
+    def __init__(self):
+        self.outcome = SUCCESS
+
+
+class CircuitBreaker:
+    """Stops all requests after repeated throttling and lets one probe through
+    once the cool-down has passed.
+
+    Each consecutive trip doubles the cool-down, up to `max_reset_timeout`.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=60, max_reset_timeout=900):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Condition()
+
+    def _timeout(self):
+        return min(self.reset_timeout * 2 ** max(self.trips - 1, 0), self.max_reset_timeout)
+
+    def _trip(self):
+        self.state = self.OPEN
+        self.trips += 1
+        self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self._lock.notify_all()
+        print(f"Circuit breaker opened for {self._timeout()}s after {self.failures} throttled requests")
+
+    def seconds_until_retry(self):
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0
+            return max(0.0, self.opened_at + self._timeout() - time.monotonic())
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() >= self.opened_at + self._timeout():
+                self.state = self.HALF_OPEN
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            # Requests that started before the breaker tripped don't close it again
+            if self.state == self.OPEN:
+                return
+            if self.state == self.HALF_OPEN:
+                print("Circuit breaker closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trips = 0
+            self._probe_in_flight = False
+            self._lock.notify_all()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self._trip()
+
+    def wait(self, timeout):
+        """Block until the breaker closes or trips again, or `timeout` passes"""
+        with self._lock:
+            self._lock.wait_for(lambda: self.state != self.HALF_OPEN or not self._probe_in_flight, timeout)
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.failures, 'trips': self.trips}
+
+
+class BreakerOpen(Exception):
+    """Raised instead of making a request while the circuit breaker holds requests back"""
+
+
+@contextmanager
+def guarded_request(limiter, breaker):
+    """Make one upstream request under the limiter and circuit breaker.
+
+    Only the request itself should be wrapped, so cache hits, storage writes
+    and calls to other services neither hold a slot nor count as successes.
+    Raises BreakerOpen without making the request while the breaker is open.
+    """
+    with limiter.slot() as slot:
+        # Checked after getting a slot, since the breaker may have tripped while we waited
+        if not breaker.allow_request():
+            slot.outcome = SKIPPED
+            raise BreakerOpen("Circuit breaker is open")
+
+        try:
+            yield
+        except Exception as e:
+            if is_throttle_error(e):
+                slot.outcome = THROTTLED
+                breaker.record_failure()
+            else:
+                # YouTube answered, so this isn't a sign of throttling
+                breaker.record_success()
+            raise
+        breaker.record_success()
+
+
+def run_with_backoff(items, work, breaker, on_error, on_pause=None, on_resume=None,
+                     max_attempts=8, max_workers=16):
+    """Run `work(item)` for every item, requeueing the ones that hit throttling.
+
+    `work` wraps its upstream requests in `guarded_request`. Items that are
+    throttled or held back by the open breaker are requeued rather than
+    dropped, and while the breaker is open the run pauses until it lets
+    requests through again. `on_error(item, exc, requeued)` is called for every
+    failure; an item is only given up on when it fails for another reason or
+    has been throttled `max_attempts` times.
+    """
+    pending = deque(items)
+    attempts = {}
+    lock = threading.Lock()
+
+    def attempt(item):
+        try:
+            work(item)
+        except BreakerOpen:
+            with lock:
+                pending.append(item)
+            return False
+        except Exception as e:
+            if not is_throttle_error(e):
+                on_error(item, e, False)
+                return True
+
+            with lock:
+                attempts[id(item)] = attempts.get(id(item), 0) + 1
+                requeue = attempts[id(item)] < max_attempts
+                if requeue:
+                    pending.append(item)
+            on_error(item, e, requeue)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending:
+            wait = breaker.seconds_until_retry()
+            if wait > 0:
+                if on_pause:
+                    on_pause(wait)
+                time.sleep(wait)
+                if on_resume:
+                    on_resume()
+
+            with lock:
+                batch = list(pending)
+                pending.clear()
+            attempted = list(executor.map(attempt, batch))
+            if not any(attempted):
+                # Another run holds the half-open probe. Wait for its outcome
+                # instead of requeueing the same items in a tight loop.
+                breaker.wait(PROBE_WAIT)
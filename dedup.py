@@ -0,0 +1,276 @@
+# dedup.py
+import hashlib
+import json
+import random
+import re
+import threading
+
+import numpy as np
+
+from storage import PreconditionFailed
+
+# Signatures are only comparable if they were built with the same permutations,
+# so these must not change once an index has been written to disk.
+NUM_PERM = 128
+SEED = 1
+SHINGLE_SIZE = 5
+
+# Mersenne prime used for the universal hash permutations
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+_rng = random.Random(SEED)
+PERMUTATIONS = [
+    (_rng.randint(1, MERSENNE_PRIME - 1), _rng.randint(0, MERSENNE_PRIME - 1))
+    for _ in range(NUM_PERM)
+]
+
+# The permutations split into 32-bit halves, so every product fits in uint64
+_A = np.array([a for a, _ in PERMUTATIONS], dtype=np.uint64)
+_A_LO = (_A & np.uint64(0xFFFFFFFF))[:, None]
+_A_HI = (_A >> np.uint64(32))[:, None]
+_B = np.array([b for _, b in PERMUTATIONS], dtype=np.uint64)[:, None]
+_PRIME = np.uint64(MERSENNE_PRIME)
+
+# Shingles hashed per chunk, bounding the permutation matrix to NUM_PERM x chunk
+SIGNATURE_CHUNK = 4096
+
+WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Overlapping word n-grams of normalized text"""
+    words = WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _mod_prime(x):
+    """x mod 2^61-1 for uint64 arrays, using 2^61 = 1 (mod 2^61-1)"""
+    x = (x & _PRIME) + (x >> np.uint64(61))
+    return np.where(x >= _PRIME, x - _PRIME, x)
+
+
+def _permute(hashes):
+    """(a * h + b) mod 2^61-1 for every permutation and hash, computed exactly
+    in uint64 by splitting `a` into 32-bit halves"""
+    low = _mod_prime(_A_LO * hashes)
+    high = _A_HI * hashes
+    # high * 2^32, folding the bits above 2^61 back in
+    high = _mod_prime((high >> np.uint64(29)) + ((high & np.uint64((1 << 29) - 1)) << np.uint64(32)))
+    return _mod_prime(low + high + _B)
+
+
+def minhash_signature(text):
+    """MinHash signature of a text's shingles"""
+    hashes = np.array([
+        int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little')
+        for shingle in shingles(text)
+    ], dtype=np.uint64)
+    if not len(hashes):
+        return [MAX_HASH] * NUM_PERM
+
+    signature = np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(hashes), SIGNATURE_CHUNK):
+        chunk = _permute(hashes[None, start:start + SIGNATURE_CHUNK])
+        signature = np.minimum(signature, chunk.min(axis=1))
+    return (signature & np.uint64(MAX_HASH)).tolist()
+
+
+def estimate_similarity(signature, other):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+
+
+def _integrate(f, a, b, steps=100):
+    step = (b - a) / steps
+    return sum(f(a + (i + 0.5) * step) for i in range(steps)) * step
+
+
+def optimal_bands(threshold, num_perm=NUM_PERM):
+    """Pick the LSH (bands, rows) split that minimizes false positives plus
+    false negatives around the similarity threshold"""
+    best = None
+    for bands in range(1, num_perm + 1):
+        max_rows = num_perm // bands
+        for rows in range(1, max_rows + 1):
+            false_positives = _integrate(lambda s: 1 - (1 - s ** rows) ** bands, 0.0, threshold)
+            false_negatives = _integrate(lambda s: (1 - s ** rows) ** bands, threshold, 1.0)
+            error = false_positives + false_negatives
+            if best is None or error < best[0]:
+                best = (error, bands, rows)
+    return best[1], best[2]
+
+
+# The shared index is a numbered log of one-record segments. Every this many
+# segments a snapshot of all records so far is written, so loading only has to
+# replay the segments added since the latest one.
+SNAPSHOT_EVERY = 256
+SEGMENT_NAME = '{:08d}.jsonl'
+SNAPSHOT_RE = re.compile(r'^snapshot-(\d{8})\.jsonl$')
+
+
+class MinHashIndex:
+    """Incremental MinHash/LSH index of transcripts.
+
+    Signatures are kept in `storage` under `prefix`, so every node sharing the
+    storage sees the same documents in the same order. Each new document claims
+    the next segment number with a create-only write; a node that loses the race
+    reads the winner's segment and checks the document again. Band buckets are
+    rebuilt on load, so a lookup only compares against the documents that share
+    a bucket rather than everything collected so far.
+    """
+
+    def __init__(self, storage, prefix, threshold=0.8):
+        self.storage = storage
+        self.prefix = prefix
+        self.threshold = threshold
+        self.bands, self.rows = optimal_bands(threshold)
+        self._lock = threading.Lock()
+        self._signatures = {}
+        self._order = {}
+        self._buckets = [{} for _ in range(self.bands)]
+        self._next_segment = 0
+        self._load()
+
+    def _segment_key(self, number):
+        return f"{self.prefix}/{SEGMENT_NAME.format(number)}"
+
+    def _insert_records(self, data):
+        for line in data.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if len(record['signature']) != NUM_PERM:
+                continue
+            self._insert(record['id'], record['signature'])
+
+    def _load(self):
+        """Start from the latest snapshot and replay the segments after it"""
+        snapshots = sorted(
+            int(match.group(1)) for match in map(SNAPSHOT_RE.match, self.storage.list_files(self.prefix))
+            if match
+        )
+        if snapshots:
+            data, _ = self.storage.read_versioned(f"{self.prefix}/snapshot-{snapshots[-1]:08d}.jsonl")
+            if data is not None:
+                self._insert_records(data)
+                self._next_segment = snapshots[-1]
+        self._catch_up()
+
+    def _catch_up(self):
+        """Read the segments other nodes have added since the last look"""
+        while True:
+            data, _ = self.storage.read_versioned(self._segment_key(self._next_segment))
+            if data is None:
+                return
+            self._insert_records(data)
+            self._next_segment += 1
+
+    def _snapshot(self):
+        records = sorted(self._order, key=self._order.get)
+        data = ''.join(
+            json.dumps({'id': doc_id, 'signature': self._signatures[doc_id]}) + "\n" for doc_id in records
+        )
+        try:
+            self.storage.write_if_version(
+                f"{self.prefix}/snapshot-{self._next_segment:08d}.jsonl", data.encode('utf-8'), None
+            )
+        except PreconditionFailed:
+            # Another node wrote the same snapshot
+            pass
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            start = band * self.rows
+            yield band, tuple(signature[start:start + self.rows])
+
+    def _insert(self, doc_id, signature):
+        if doc_id in self._signatures:
+            return
+        self._signatures[doc_id] = signature
+        self._order[doc_id] = len(self._order)
+        for band, key in self._band_keys(signature):
+            self._buckets[band].setdefault(key, []).append(doc_id)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._signatures
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def query(self, signature):
+        """Documents whose estimated similarity meets the threshold, most similar first"""
+        candidates = set()
+        for band, key in self._band_keys(signature):
+            candidates.update(self._buckets[band].get(key, ()))
+
+        matches = []
+        for doc_id in candidates:
+            similarity = estimate_similarity(signature, self._signatures[doc_id])
+            if similarity >= self.threshold:
+                matches.append((doc_id, similarity))
+        return sorted(matches, key=lambda match: -match[1])
+
+    def add(self, doc_id, text):
+        """Add a document and return the earlier documents it duplicates.
+
+        Only documents added before this one count, so re-adding the same
+        collection always keeps the same originals.
+        """
+        signature = None
+        with self._lock:
+            while True:
+                self._catch_up()
+                is_new = doc_id not in self._signatures
+                if is_new:
+                    signature = signature or minhash_signature(text)
+                else:
+                    signature = self._signatures[doc_id]
+
+                order = self._order.get(doc_id, len(self._order))
+                duplicates = [
+                    (other_id, similarity) for other_id, similarity in self.query(signature)
+                    if other_id != doc_id and self._order[other_id] < order
+                ]
+                if not is_new:
+                    return duplicates
+
+                record = json.dumps({'id': doc_id, 'signature': signature}) + "\n"
+                try:
+                    self.storage.write_if_version(
+                        self._segment_key(self._next_segment), record.encode('utf-8'), None
+                    )
+                except PreconditionFailed:
+                    # Another node took this segment, so check against its document too
+                    continue
+
+                self._insert(doc_id, signature)
+                self._next_segment += 1
+                if self._next_segment % SNAPSHOT_EVERY == 0:
+                    self._snapshot()
+                return duplicates
+
+
+def duplicate_clusters(duplicate_pairs):
+    """Group (duplicate, original) pairs into clusters keyed by their earliest original"""
+    parent = {}
+
+    def find(doc_id):
+        parent.setdefault(doc_id, doc_id)
+        while parent[doc_id] != doc_id:
+            parent[doc_id] = parent[parent[doc_id]]
+            doc_id = parent[doc_id]
+        return doc_id
+
+    for duplicate, original in duplicate_pairs:
+        # The original always wins so each cluster is rooted at its earliest document
+        parent[find(duplicate)] = find(original)
+
+    clusters = {}
+    for doc_id in parent:
+        root = find(doc_id)
+        if doc_id != root:
+            clusters.setdefault(root, []).append(doc_id)
+    return clusters
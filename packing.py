@@ -0,0 +1,188 @@
+# packing.py
+import json
+import re
+from itertools import chain, islice
+
+import tiktoken
+
+ENCODING_NAME = 'cl100k_base'
+
+# Records are tokenized together until a batch holds this many characters,
+# which bounds memory no matter how long individual transcripts are
+BATCH_CHARS = 4 * 1024 * 1024
+
+# How many tokens a window may give up to end between words
+BOUNDARY_SLACK = 32
+
+SHARD_PATTERN = re.compile(r'^packed-(\d{5})\.(jsonl|stats\.json)$')
+
+
+def _batches(texts, batch_chars=BATCH_CHARS):
+    """Group texts into lists of at most `batch_chars` characters"""
+    batch, size = [], 0
+    for text in texts:
+        if batch and size + len(text) > batch_chars:
+            yield batch
+            batch, size = [], 0
+        batch.append(text)
+        size += len(text)
+    if batch:
+        yield batch
+
+
+def tokenize(texts, encoding, batch_chars=BATCH_CHARS):
+    """Yield (text, tokens) for each text, encoding a whole batch per call so
+    tiktoken can spread the work over its threads"""
+    for batch in _batches(texts, batch_chars):
+        yield from zip(batch, encoding.encode_ordinary_batch(batch))
+
+
+def _window_end(tokens, start, end, encoding):
+    """Move a window end back to the start of a word if one is close"""
+    if end >= len(tokens):
+        return len(tokens)
+    for position in range(end, max(start + 1, end - BOUNDARY_SLACK), -1):
+        if encoding.decode_single_token_bytes(tokens[position])[:1].isspace():
+            return position
+    return end
+
+
+def split_tokens(tokens, max_tokens, overlap, encoding):
+    """Split a token list into windows of at most `max_tokens`, each starting
+    `overlap` tokens before the previous one ended"""
+    if len(tokens) <= max_tokens:
+        return [tokens] if tokens else []
+
+    windows = []
+    start = 0
+    while start < len(tokens):
+        end = _window_end(tokens, start, start + max_tokens, encoding)
+        windows.append(tokens[start:end])
+        if end >= len(tokens):
+            break
+        start = max(end - overlap, start + 1)
+    return windows
+
+
+class _Bin:
+    __slots__ = ('samples', 'tokens')
+
+    def __init__(self):
+        self.samples = []
+        self.tokens = 0
+
+
+class SequencePacker:
+    """Packs token-bounded samples into sequences of `sequence_length` tokens.
+
+    Samples are placed with online best fit: each goes into the open sequence
+    with the least room that still fits it. At most `max_open_bins` sequences
+    are kept open, and the fullest is emitted to make room, so memory stays
+    bounded however much data is streamed through.
+    """
+
+    def __init__(self, sequence_length=2048, overlap=0, separator='<|endoftext|>',
+                 max_open_bins=64, encoding_name=ENCODING_NAME):
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.sequence_length = sequence_length
+        self.overlap = min(overlap, sequence_length // 2)
+        self.separator = separator
+        self.separator_tokens = len(self.encoding.encode(separator, allowed_special='all'))
+        self.max_open_bins = max_open_bins
+        self.split_records = 0
+
+    def samples(self, texts):
+        """Yield (text, token count) samples of at most `sequence_length` tokens"""
+        for text, tokens in tokenize(texts, self.encoding):
+            windows = split_tokens(tokens, self.sequence_length, self.overlap, self.encoding)
+            if len(windows) > 1:
+                self.split_records += 1
+            for window in windows:
+                if len(windows) == 1:
+                    yield text, len(window)
+                else:
+                    yield self.encoding.decode(window), len(window)
+
+    def _sequence(self, packed):
+        return {
+            'input': self.separator.join(packed.samples),
+            'output': None,
+            'num_tokens': packed.tokens,
+            'num_samples': len(packed.samples)
+        }
+
+    def pack(self, texts):
+        """Yield packed sequences for a stream of texts"""
+        bins = []
+        for text, num_tokens in self.samples(texts):
+            best = None
+            for candidate in bins:
+                needed = num_tokens + (self.separator_tokens if candidate.samples else 0)
+                room = self.sequence_length - candidate.tokens
+                if needed <= room and (best is None or room < self.sequence_length - best.tokens):
+                    best = candidate
+
+            if best is None:
+                if len(bins) >= self.max_open_bins:
+                    fullest = max(bins, key=lambda b: b.tokens)
+                    bins.remove(fullest)
+                    yield self._sequence(fullest)
+                best = _Bin()
+                bins.append(best)
+
+            if best.samples:
+                best.tokens += self.separator_tokens
+            best.samples.append(text)
+            best.tokens += num_tokens
+
+            if best.tokens >= self.sequence_length:
+                bins.remove(best)
+                yield self._sequence(best)
+
+        for remaining in sorted(bins, key=lambda b: b.tokens, reverse=True):
+            yield self._sequence(remaining)
+
+
+def _fill_ratio(tokens, sequences, sequence_length):
+    capacity = sequences * sequence_length
+    return round(tokens / capacity, 4) if capacity else 0.0
+
+
+def write_shards(sequences, storage, prefix, sequence_length, shard_size=10000):
+    """Write packed sequences to `<prefix>/packed-NNNNN.jsonl` shards, each with
+    a `.stats.json` of its token counts beside it, and return the totals"""
+    sequences = iter(sequences)
+    shard_count = 0
+    totals = {'shards': 0, 'sequences': 0, 'samples': 0, 'tokens': 0, 'padding_tokens': 0}
+
+    while True:
+        first = next(sequences, None)
+        if first is None:
+            break
+
+        shard_key = f"{prefix}/packed-{shard_count:05d}"
+        stats = {'sequences': 0, 'samples': 0, 'tokens': 0}
+        with storage.open_write(f"{shard_key}.jsonl", 'w', encoding='utf-8') as f:
+            for sequence in chain([first], islice(sequences, shard_size - 1)):
+                f.write(json.dumps(sequence) + "\n")
+                stats['sequences'] += 1
+                stats['samples'] += sequence['num_samples']
+                stats['tokens'] += sequence['num_tokens']
+        stats['padding_tokens'] = stats['sequences'] * sequence_length - stats['tokens']
+        stats['fill_ratio'] = _fill_ratio(stats['tokens'], stats['sequences'], sequence_length)
+        stats['sequence_length'] = sequence_length
+        storage.write_text(f"{shard_key}.stats.json", json.dumps(stats, indent=2))
+
+        shard_count += 1
+        totals['shards'] += 1
+        for name in ('sequences', 'samples', 'tokens', 'padding_tokens'):
+            totals[name] += stats[name]
+
+    # Shards left over from an earlier, larger run would otherwise be mixed in
+    for file_name in storage.list_files(prefix):
+        match = SHARD_PATTERN.match(file_name)
+        if match and int(match.group(1)) >= shard_count:
+            storage.delete(f"{prefix}/{file_name}")
+
+    totals['fill_ratio'] = _fill_ratio(totals['tokens'], totals['sequences'], sequence_length)
+    return totals
@@ -0,0 +1,149 @@
+# quota.py
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from storage import PreconditionFailed
+
+# Unit cost of each YouTube Data API call type
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    'search.list': 100,
+    'videos.list': 1,
+    'channels.list': 1,
+    'playlists.list': 1,
+    'playlistItems.list': 1,
+}
+
+# Request priorities. Interactive requests come from a user waiting on a page
+# or API response, background requests come from crawls and batch jobs.
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+# The daily quota resets at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+# How often a charge is retried when other nodes keep updating the state first
+UPDATE_ATTEMPTS = 20
+
+
+class QuotaExceeded(Exception):
+    """Raised when a call cannot be afforded from the remaining daily budget"""
+
+    def __init__(self, call_type, priority, remaining):
+        self.call_type = call_type
+        self.priority = priority
+        self.remaining = remaining
+        super().__init__(
+            f"Not enough YouTube quota for {call_type} ({priority}): "
+            f"{remaining} units remaining"
+        )
+
+
+class QuotaScheduler:
+    """Charges YouTube Data API calls against a persisted daily budget.
+
+    Background calls may only spend down to `background_reserve` units so that
+    the remainder of the day's budget stays available for interactive requests.
+
+    The state is kept in `storage` under `state_key` and every charge is a
+    conditional read-modify-write, so all nodes sharing the storage spend from
+    one budget.
+    """
+
+    def __init__(self, storage, state_key='quota.json', daily_limit=10000, background_reserve=1000):
+        self.storage = storage
+        self.state_key = state_key
+        self.daily_limit = daily_limit
+        self.background_reserve = background_reserve
+        self._lock = threading.Lock()
+
+    def _today(self):
+        return datetime.now(QUOTA_TIMEZONE).date().isoformat()
+
+    def _empty_state(self):
+        return {
+            'date': self._today(),
+            'used': 0,
+            'by_call_type': {},
+            'by_priority': {INTERACTIVE: 0, BACKGROUND: 0},
+            'rejected': {INTERACTIVE: 0, BACKGROUND: 0}
+        }
+
+    def _load(self):
+        """Today's state and the version it was read at"""
+        data, version = self.storage.read_versioned(self.state_key)
+        if data is not None:
+            try:
+                state = json.loads(data)
+                if state.get('date') == self._today():
+                    return state, version
+            except ValueError as e:
+                print(f"Could not load quota state from {self.state_key}: {e}")
+        return self._empty_state(), version
+
+    def _update(self, change):
+        """Apply `change(state)` to the shared state and return its result,
+        starting over whenever another node updated the state in between"""
+        with self._lock:
+            for _ in range(UPDATE_ATTEMPTS):
+                state, version = self._load()
+                result = change(state)
+                try:
+                    self.storage.write_if_version(self.state_key, json.dumps(state).encode('utf-8'), version)
+                    return result
+                except PreconditionFailed:
+                    time.sleep(random.uniform(0, 0.05))
+        raise RuntimeError(f"Could not update {self.state_key}: too many concurrent writers")
+
+    def _available(self, state, priority):
+        remaining = self.daily_limit - state['used']
+        if priority == BACKGROUND:
+            remaining -= self.background_reserve
+        return max(remaining, 0)
+
+    def charge(self, call_type, priority=INTERACTIVE, count=1):
+        """Record `count` calls of `call_type`, raising QuotaExceeded if they don't fit"""
+        cost = QUOTA_COSTS[call_type] * count
+
+        def change(state):
+            available = self._available(state, priority)
+            if cost > available:
+                state['rejected'][priority] += 1
+                return available
+            state['used'] += cost
+            state['by_call_type'][call_type] = state['by_call_type'].get(call_type, 0) + cost
+            state['by_priority'][priority] += cost
+            return None
+
+        # The rejection is recorded before it is raised
+        rejected_at = self._update(change)
+        if rejected_at is not None:
+            raise QuotaExceeded(call_type, priority, rejected_at)
+
+    def execute(self, call_type, request_fn, priority=INTERACTIVE):
+        """Charge for a call and then run it.
+
+        YouTube bills failed requests too, so the charge is made up front.
+        """
+        self.charge(call_type, priority)
+        return request_fn()
+
+    def usage(self):
+        """Snapshot of today's usage"""
+        state, _ = self._load()
+        return {
+            'date': state['date'],
+            'daily_limit': self.daily_limit,
+            'background_reserve': self.background_reserve,
+            'used': state['used'],
+            'remaining': max(self.daily_limit - state['used'], 0),
+            'remaining_background': self._available(state, BACKGROUND),
+            'by_call_type': dict(state['by_call_type']),
+            'by_priority': dict(state['by_priority']),
+            'rejected': dict(state['rejected']),
+            'costs': dict(QUOTA_COSTS)
+        }
@@ -0,0 +1,398 @@
+# storage.py
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import boto3
+from botocore.exceptions import ClientError
+
+try:
+    import fcntl
+except ImportError:
+    # Without flock, conditional writes are only serialised within one process
+    fcntl = None
+
+CHUNK_SIZE = 64 * 1024
+
+
+class PreconditionFailed(Exception):
+    """A conditional write found the artifact changed since it was read"""
+
+
+def _is_missing(error):
+    return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+
+def _is_precondition_failure(error):
+    code = error.response.get('Error', {}).get('Code')
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return code in ('PreconditionFailed', 'ConditionalRequestConflict') or status in (409, 412)
+
+
+class LocalStorage:
+    """Stores artifacts as files under a local root directory.
+
+    Keys are '/'-separated paths relative to the root, such as
+    'transcripts/<video_id>/original.txt'. Writes go to a temp file that is
+    moved into place, so readers never see a partially written file.
+    """
+
+    def __init__(self, root='storage'):
+        self.root = root
+        self._conditional_lock = threading.Lock()
+
+    def cache_path(self, key):
+        """Path of a key in the local tier, whether or not it is there yet"""
+        return os.path.join(self.root, *key.split('/'))
+
+    def key(self, path):
+        """Key of a path under the root"""
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def local_path(self, key):
+        """Local path of an artifact, for code that needs a real file.
+
+        Returns None if the artifact doesn't exist.
+        """
+        path = self.cache_path(key)
+        return path if os.path.isfile(path) else None
+
+    def exists(self, key):
+        return os.path.isfile(self.cache_path(key))
+
+    def read_bytes(self, key):
+        path = self.local_path(key)
+        if path is None:
+            raise FileNotFoundError(key)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def read_text(self, key):
+        return self.read_bytes(key).decode('utf-8')
+
+    @contextmanager
+    def open_write(self, key, mode='wb', encoding=None):
+        """Write an artifact through a temp file that replaces it once closed"""
+        path = self.cache_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, mode, encoding=encoding) as f:
+                yield f
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.commit_local(key)
+
+    def write_bytes(self, key, data):
+        with self.open_write(key) as f:
+            f.write(data)
+
+    def write_text(self, key, text):
+        self.write_bytes(key, text.encode('utf-8'))
+
+    def commit_local(self, key):
+        """Publish a file that was written directly to its local path"""
+
+    def delete(self, key):
+        path = self.cache_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def list_dirs(self, prefix):
+        """Names of the directories directly under a prefix"""
+        path = self.cache_path(prefix)
+        if not os.path.isdir(path):
+            return []
+        return sorted(name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+
+    def list_files(self, prefix):
+        """Names of the files directly under a prefix"""
+        path = self.cache_path(prefix)
+        if not os.path.isdir(path):
+            return []
+        return sorted(
+            name for name in os.listdir(path)
+            if os.path.isfile(os.path.join(path, name)) and not name.endswith(('.tmp', '.part', '.lock'))
+        )
+
+    def stat_files(self, prefix):
+        """(size, mtime) of the files directly under a prefix, by name"""
+        stats = {}
+        for name in self.list_files(prefix):
+            try:
+                stat = os.stat(self.cache_path(f"{prefix}/{name}"))
+            except FileNotFoundError:
+                continue
+            stats[name] = (stat.st_size, int(stat.st_mtime))
+        return stats
+
+    def read_versioned(self, key):
+        """Read an artifact together with a version to pass to write_if_version.
+
+        Returns (None, None) if the artifact doesn't exist.
+        """
+        try:
+            with open(self.cache_path(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None, None
+        return data, hashlib.md5(data).hexdigest()
+
+    @contextmanager
+    def _locked(self, path):
+        with self._conditional_lock:
+            with open(f"{path}.lock", 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def write_if_version(self, key, data, version):
+        """Write an artifact only if it is still at `version`, as returned by
+        read_versioned, or only if it doesn't exist yet when `version` is None.
+
+        Raises PreconditionFailed if another writer got there first.
+        """
+        path = self.cache_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            if version is None:
+                # Linking fails if the file exists, which makes creation atomic
+                try:
+                    os.link(tmp_path, path)
+                except FileExistsError:
+                    raise PreconditionFailed(key) from None
+            else:
+                with self._locked(path):
+                    if self.read_versioned(key)[1] != version:
+                        raise PreconditionFailed(key)
+                    os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def read_range(self, key, start, end, chunk_size=CHUNK_SIZE):
+        """Yield bytes [start, end) of an artifact without loading it whole"""
+        remaining = end - start
+        with open(self.cache_path(key), 'rb') as f:
+            f.seek(start)
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+
+class S3Storage(LocalStorage):
+    """Stores artifacts in an S3-compatible bucket shared by every node.
+
+    The local root is kept as a read-through cache tier: reads are served from
+    it when possible and fill it otherwise, and writes land in it before being
+    uploaded. S3 replaces objects atomically, so other nodes only ever see
+    complete artifacts.
+
+    Local copies are checked against the bucket's ETag at most every
+    `revalidate_after` seconds, so an artifact rewritten by another node is
+    picked up on the next read after that. Copies that were never uploaded,
+    or whose object was deleted, are served as they are.
+    """
+
+    def __init__(self, bucket, prefix='', root='storage', client=None, revalidate_after=30):
+        super().__init__(root)
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = client or boto3.client('s3')
+        self.revalidate_after = revalidate_after
+        # key -> (ETag of the local copy, when it was last checked)
+        self._validated = {}
+
+    def _object_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _head(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if _is_missing(e):
+                return None
+            raise
+
+    def _remember(self, key, etag, last_modified):
+        """Record which version of an object the local copy holds.
+
+        The copy's mtime is set to the object's LastModified so it can still be
+        compared after a restart, when the remembered ETags are gone.
+        """
+        modified = last_modified.timestamp()
+        os.utime(self.cache_path(key), (modified, modified))
+        self._validated[key] = (etag, time.monotonic())
+
+    def _recently_validated(self, key):
+        validated = self._validated.get(key)
+        return validated is not None and time.monotonic() - validated[1] < self.revalidate_after
+
+    def _is_current(self, key, path):
+        """Check whether the local copy of an artifact matches the bucket"""
+        if self._recently_validated(key):
+            return True
+
+        head = self._head(key)
+        if head is None:
+            # Not uploaded yet, or deleted: the local copy is all there is
+            return True
+
+        validated = self._validated.get(key)
+        if validated is not None:
+            current = validated[0] == head['ETag']
+        else:
+            stat = os.stat(path)
+            current = (stat.st_size == head['ContentLength']
+                       and int(stat.st_mtime) >= int(head['LastModified'].timestamp()))
+        if current:
+            self._validated[key] = (head['ETag'], time.monotonic())
+        return current
+
+    def _download(self, key):
+        """Fill the local tier with the bucket's copy of an artifact"""
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if _is_missing(e):
+                return None
+            raise
+
+        path = self.cache_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in response['Body'].iter_chunks(CHUNK_SIZE):
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._remember(key, response['ETag'], response['LastModified'])
+        return path
+
+    def local_path(self, key):
+        path = self.cache_path(key)
+        if os.path.isfile(path) and self._is_current(key, path):
+            return path
+        return self._download(key)
+
+    def exists(self, key):
+        if super().exists(key):
+            return True
+        return self._head(key) is not None
+
+    def commit_local(self, key):
+        self.client.upload_file(self.cache_path(key), self.bucket, self._object_key(key))
+        head = self._head(key)
+        if head is not None:
+            self._remember(key, head['ETag'], head['LastModified'])
+
+    def delete(self, key):
+        super().delete(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        self._validated.pop(key, None)
+
+    def _list(self, prefix):
+        object_prefix = self._object_key(prefix.strip('/')) + '/'
+        dirs, files = set(), {}
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=object_prefix, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', []):
+                dirs.add(common_prefix['Prefix'][len(object_prefix):].rstrip('/'))
+            for item in page.get('Contents', []):
+                files[item['Key'][len(object_prefix):]] = (item['Size'], int(item['LastModified'].timestamp()))
+        return dirs, files
+
+    def list_dirs(self, prefix):
+        dirs, _ = self._list(prefix)
+        return sorted(dirs | set(super().list_dirs(prefix)))
+
+    def list_files(self, prefix):
+        _, files = self._list(prefix)
+        return sorted(set(files) | set(super().list_files(prefix)))
+
+    def stat_files(self, prefix):
+        # The bucket's listing is authoritative, local-only files fill the gaps
+        _, files = self._list(prefix)
+        stats = super().stat_files(prefix)
+        stats.update(files)
+        return stats
+
+    def read_versioned(self, key):
+        # Always asks the bucket, since the version must be the shared one
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if _is_missing(e):
+                return None, None
+            raise
+        return response['Body'].read(), response['ETag']
+
+    def write_if_version(self, key, data, version):
+        # S3 conditional writes: If-None-Match creates, If-Match replaces a known version
+        condition = {'IfNoneMatch': '*'} if version is None else {'IfMatch': version}
+        try:
+            self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data, **condition)
+        except ClientError as e:
+            if _is_precondition_failure(e) or (version is not None and _is_missing(e)):
+                raise PreconditionFailed(key) from e
+            raise
+        self._validated.pop(key, None)
+
+    def read_range(self, key, start, end, chunk_size=CHUNK_SIZE):
+        # Reuse a local copy only if it was just validated, and never fill the
+        # local tier just to stream an artifact once
+        if self._recently_validated(key) and os.path.isfile(self.cache_path(key)):
+            yield from super().read_range(key, start, end, chunk_size)
+            return
+        if end <= start:
+            return
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket,
+                Key=self._object_key(key),
+                Range=f"bytes={start}-{end - 1}"
+            )
+        except ClientError as e:
+            # Written here but not uploaded yet
+            if _is_missing(e) and os.path.isfile(self.cache_path(key)):
+                yield from super().read_range(key, start, end, chunk_size)
+                return
+            raise
+        yield from response['Body'].iter_chunks(chunk_size)
+
+
+def storage_from_env(root='storage'):
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    backend = os.getenv('STORAGE_BACKEND', 'local')
+    if backend == 'local':
+        return LocalStorage(root)
+    if backend == 's3':
+        client = boto3.client(
+            's3',
+            endpoint_url=os.getenv('STORAGE_S3_ENDPOINT_URL') or None,
+            region_name=os.getenv('STORAGE_S3_REGION') or None
+        )
+        return S3Storage(
+            os.environ['STORAGE_S3_BUCKET'],
+            prefix=os.getenv('STORAGE_S3_PREFIX', ''),
+            root=root,
+            client=client,
+            revalidate_after=float(os.getenv('STORAGE_S3_REVALIDATE', 30))
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,268 @@
+# storage_manager.py
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from transcript_index import index_path
+
+# Regenerable artifact classes, in the order they are evicted when over budget.
+# Audio can be re-synthesized and translations re-requested; original
+# transcripts and caches are kept.
+EVICTION_ORDER = ['audio', 'translation']
+
+# Files modified this recently are assumed to still be written
+WRITE_GRACE_SECONDS = 60
+
+
+def artifact_class(relative_path):
+    """Classify a file under the storage root"""
+    name = os.path.basename(relative_path)
+    if name.endswith('_audio.mp3'):
+        return 'audio'
+    if name == 'translated.txt':
+        return 'translation'
+    if relative_path.startswith('transcripts' + os.sep):
+        return 'transcript'
+    return 'cache'
+
+
+class StorageManager:
+    """Tracks the size and last access of everything under the storage root and
+    keeps regenerable artifacts within their disk budgets.
+
+    Budgets are in bytes per artifact class, plus an optional 'total' budget.
+    Files that are pinned, still being written or reported busy by `in_use`
+    are never evicted. Files are deleted outside the lock; a file that is
+    being deleted can't be pinned until the delete is done, so a caller that
+    pins before resolving a path either finds it gone or keeps it.
+    """
+
+    def __init__(self, root, budgets=None, interval=300, in_use=None):
+        self.root = root
+        self.budgets = {name: limit for name, limit in (budgets or {}).items() if limit}
+        self.interval = interval
+        self.in_use = in_use
+        self.index_file = os.path.join(root, 'storage_index.json')
+        self.evicted = {}
+        self._pins = {}
+        self._evicting = set()
+        self._lock = threading.Condition()
+        self._index = self._load()
+        self._thread = None
+
+    def _load(self):
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not load storage index: {e}")
+        return {}
+
+    def _save(self):
+        with self._lock:
+            data = json.dumps(self._index)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.index_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.index_file)
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.root)
+
+    def record_access(self, path):
+        """Mark a file as just used, so it is the last to be evicted"""
+        relative_path = self._relative(path)
+        with self._lock:
+            entry = self._index.get(relative_path)
+            if entry is None and os.path.isfile(path):
+                entry = self._index[relative_path] = {
+                    'size': os.path.getsize(path),
+                    'class': artifact_class(relative_path)
+                }
+            if entry is not None:
+                entry['atime'] = time.time()
+
+    def pin(self, path):
+        with self._lock:
+            while path in self._evicting:
+                self._lock.wait()
+            self._pins[path] = self._pins.get(path, 0) + 1
+
+    def unpin(self, path):
+        with self._lock:
+            count = self._pins.get(path, 0) - 1
+            if count > 0:
+                self._pins[path] = count
+            else:
+                self._pins.pop(path, None)
+
+    @contextmanager
+    def pinned(self, path):
+        """Protect a file from eviction while it is being read or written"""
+        self.pin(path)
+        try:
+            yield
+        finally:
+            self.unpin(path)
+
+    def scan(self):
+        """Bring the index in line with what is on disk"""
+        seen = set()
+        for directory, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                if path == self.index_file or file_name.endswith(('.part', '.tmp', '.lock')):
+                    continue
+                relative_path = self._relative(path)
+                seen.add(relative_path)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                with self._lock:
+                    entry = self._index.setdefault(relative_path, {
+                        'atime': stat.st_mtime,
+                        'class': artifact_class(relative_path)
+                    })
+                    entry['size'] = stat.st_size
+                    entry['mtime'] = stat.st_mtime
+
+        with self._lock:
+            for relative_path in list(self._index):
+                if relative_path not in seen:
+                    del self._index[relative_path]
+
+    def _totals(self):
+        totals = {}
+        for entry in self._index.values():
+            totals[entry['class']] = totals.get(entry['class'], 0) + entry.get('size', 0)
+        return totals
+
+    def _is_busy(self, path, entry):
+        if self._pins.get(path):
+            return True
+        if time.time() - entry.get('mtime', 0) < WRITE_GRACE_SECONDS:
+            return True
+        return bool(self.in_use and self.in_use(path))
+
+    def _claim(self, relative_path):
+        """Reserve a file for deletion if it is still indexed and not busy"""
+        path = os.path.join(self.root, relative_path)
+        with self._lock:
+            entry = self._index.get(relative_path)
+            if entry is None or self._is_busy(path, entry):
+                return None
+            self._evicting.add(path)
+            return dict(entry)
+
+    def _remove(self, artifact, path):
+        try:
+            os.remove(path)
+            if artifact == 'translation' and os.path.exists(index_path(path)):
+                os.remove(index_path(path))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Could not evict {path}: {e}")
+            return False
+        return True
+
+    def _evict_class(self, artifact, bytes_to_free):
+        """Evict least recently used files of a class until enough is freed"""
+        with self._lock:
+            candidates = sorted(
+                (relative_path for relative_path, entry in self._index.items()
+                 if entry['class'] == artifact),
+                key=lambda relative_path: self._index[relative_path].get('atime', 0)
+            )
+
+        freed = 0
+        for relative_path in candidates:
+            if freed >= bytes_to_free:
+                break
+            # Pins are re-checked per file, since they change while others are deleted
+            entry = self._claim(relative_path)
+            if entry is None:
+                continue
+
+            path = os.path.join(self.root, relative_path)
+            removed = False
+            try:
+                removed = self._remove(artifact, path)
+            finally:
+                with self._lock:
+                    self._evicting.discard(path)
+                    if removed:
+                        self._index.pop(relative_path, None)
+                        self.evicted[artifact] = self.evicted.get(artifact, 0) + 1
+                    self._lock.notify_all()
+            if removed:
+                print(f"Evicted {artifact} {relative_path} ({entry.get('size', 0)} bytes)")
+                freed += entry.get('size', 0)
+        return freed
+
+    def evict(self):
+        """Evict regenerable artifacts until every budget is met"""
+        with self._lock:
+            totals = self._totals()
+
+        for artifact in EVICTION_ORDER:
+            over = totals.get(artifact, 0) - self.budgets.get(artifact, float('inf'))
+            if over > 0:
+                totals[artifact] -= self._evict_class(artifact, over)
+
+        if 'total' in self.budgets:
+            over = sum(totals.values()) - self.budgets['total']
+            for artifact in EVICTION_ORDER:
+                if over <= 0:
+                    break
+                freed = self._evict_class(artifact, over)
+                totals[artifact] = totals.get(artifact, 0) - freed
+                over -= freed
+
+        self._save()
+
+    def run_once(self):
+        self.scan()
+        self.evict()
+
+    def start(self):
+        """Scan and evict in a background thread every `interval` seconds"""
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"Storage eviction error: {e}")
+                time.sleep(self.interval)
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def usage(self):
+        with self._lock:
+            totals = self._totals()
+            counts = {}
+            for entry in self._index.values():
+                counts[entry['class']] = counts.get(entry['class'], 0) + 1
+            return {
+                'total_bytes': sum(totals.values()),
+                'classes': {
+                    artifact: {
+                        'bytes': size,
+                        'files': counts.get(artifact, 0),
+                        'budget_bytes': self.budgets.get(artifact)
+                    }
+                    for artifact, size in totals.items()
+                },
+                'total_budget_bytes': self.budgets.get('total'),
+                'pinned': len(self._pins),
+                'evicted': dict(self.evicted)
+            }
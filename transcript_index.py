@@ -0,0 +1,102 @@
+# transcript_index.py
+import json
+import os
+
+# Target size of one window of transcript text
+WINDOW_SIZE = 16 * 1024
+
+# How far past the target size a window may grow to end on a paragraph break
+PARAGRAPH_SLACK = WINDOW_SIZE // 4
+
+
+def index_path(text_path):
+    """Path or storage key of the window index for a transcript file"""
+    root, _ = os.path.splitext(text_path)
+    return f"{root}.index.json"
+
+
+def _next_boundary(data, target):
+    """Offset at or after `target` to end a window on, preferring paragraph
+    breaks, then whitespace, and never splitting a UTF-8 character"""
+    if target >= len(data):
+        return len(data)
+
+    paragraph = data.find(b'\n\n', target, target + PARAGRAPH_SLACK)
+    if paragraph != -1:
+        return paragraph + 2
+
+    for separator in (b'\n', b' '):
+        position = data.find(separator, target, target + PARAGRAPH_SLACK)
+        if position != -1:
+            return position + 1
+
+    # No whitespace nearby, so just avoid cutting a multi-byte character
+    while target < len(data) and (data[target] & 0xC0) == 0x80:
+        target += 1
+    return target
+
+
+def build_window_index(data, window_size=WINDOW_SIZE):
+    """Byte offsets where each window of the encoded text starts"""
+    offsets = [0]
+    while True:
+        end = _next_boundary(data, offsets[-1] + window_size)
+        if end >= len(data):
+            return offsets
+        offsets.append(end)
+
+
+def write_transcript(storage, key, text):
+    """Write a transcript together with its window index"""
+    data = text.encode('utf-8')
+    storage.write_bytes(key, data)
+    _save_index(storage, key, data)
+
+
+def _save_index(storage, key, data):
+    index = {
+        'size': len(data),
+        'window_size': WINDOW_SIZE,
+        'offsets': build_window_index(data)
+    }
+    storage.write_text(index_path(key), json.dumps(index))
+    return index
+
+
+def load_window_index(storage, key):
+    """Load a transcript's window index, rebuilding it if it is missing or stale"""
+    size = os.path.getsize(storage.local_path(key))
+    index_file = storage.local_path(index_path(key))
+    if index_file is not None:
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+        if index.get('size') == size and index.get('window_size') == WINDOW_SIZE:
+            return index
+
+    # Transcripts written before indexing existed get their index on first read
+    return _save_index(storage, key, storage.read_bytes(key))
+
+
+def read_windows(storage, key, window=0, count=1):
+    """Read `count` windows of a transcript starting at `window`"""
+    index = load_window_index(storage, key)
+    offsets = index['offsets']
+    total_windows = len(offsets)
+    window = max(0, min(window, total_windows))
+    end_window = min(window + max(count, 1), total_windows)
+
+    text = ''
+    if window < total_windows:
+        start = offsets[window]
+        end = offsets[end_window] if end_window < total_windows else index['size']
+        with open(storage.local_path(key), 'rb') as f:
+            f.seek(start)
+            text = f.read(end - start).decode('utf-8', errors='replace')
+
+    return {
+        'window': window,
+        'count': end_window - window,
+        'total_windows': total_windows,
+        'next_window': end_window if end_window < total_windows else None,
+        'text': text
+    }
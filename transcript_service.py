@@ -6,10 +6,23 @@ from dotenv import load_dotenv
 from youtube_transcript_api import YouTubeTranscriptApi
 import os
 import json
+import hashlib
+import re
+from functools import partial
 import boto3
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
 from flask_restx import Api, Resource, fields, reqparse
-from youtube_search import display_yt_results, search_yt
+from youtube_search import display_yt_results, SearchService
+from quota import QuotaScheduler, QuotaExceeded, INTERACTIVE, BACKGROUND
+from dedup import MinHashIndex, duplicate_clusters
+from concurrency import (AdaptiveLimiter, CircuitBreaker, BreakerOpen, guarded_request, run_with_backoff,
+                         error_class, is_throttle_error)
+from archive import ArchiveEntry, RangeNotSatisfiable, archive_etag, parse_range, stream_tar, stream_zip, tar_size
+from audio_stream import AudioBroadcaster
+from transcript_index import write_transcript, read_windows
+from storage_manager import StorageManager
+from storage import storage_from_env
+from packing import SequencePacker, write_shards
 import uuid
 import threading
 import time
@@ -34,6 +47,12 @@ voice_id = "FTNCalFNG5bRnkkaP5Ug"
 # Initialize ElevenLabs client
 client = ElevenLabs(api_key=ELEVEN_LABS_API_KEY)
 
+# Transcripts, translations, audio and caches, on local disk or in a bucket shared by all nodes
+storage = storage_from_env()
+
+# Audio generations in progress, shared by everyone listening to them
+audio_broadcaster = AudioBroadcaster(on_saved=lambda path: storage.commit_local(storage.key(path)))
+
 # Initialize the Flask-RestX Api after the Flask app
 api = Api(app, 
           version='1.0', 
@@ -53,6 +72,8 @@ youtube = googleapiclient.discovery.build(
 ns_transcripts = api.namespace('transcripts', description='Transcript operations')
 ns_training = api.namespace('training', description='Training data operations')
 ns_jobs = api.namespace('jobs', description='Job operations')
+ns_quota = api.namespace('quota', description='YouTube Data API quota usage')
+ns_storage = api.namespace('storage', description='Disk usage of cached artifacts')
 
 # Define models
 transcript_model = api.model('Transcript', {
@@ -61,6 +82,13 @@ transcript_model = api.model('Transcript', {
     'transcript': fields.String(required=True, description='Video transcript')
 })
 
+bulk_ingest_model = api.model('BulkIngest', {
+    'urls': fields.List(fields.String, required=True, description='Video or playlist URLs'),
+    'translate': fields.Boolean(default=False, description='Translate transcripts to English'),
+    'force': fields.Boolean(default=False, description='Re-fetch videos that are already stored'),
+    'translation_strategy': fields.String(default='auto', enum=['auto', 'youtube', 'claude'], description='Which translation tiers to try')
+})
+
 # Define models for job responses
 job_model = api.model('Job', {
     'job_id': fields.String(required=True, description='Unique job identifier'),
@@ -74,6 +102,23 @@ job_model = api.model('Job', {
     })))
 })
 
+bulk_job_model = api.model('BulkJob', {
+    'job_id': fields.String(required=True, description='Unique job identifier'),
+    'status': fields.String(required=True, description='Job status'),
+    'total_videos': fields.Integer(required=True, description='Total number of videos to process'),
+    'processed_videos': fields.Integer(required=True, description='Number of videos processed'),
+    'error_class': fields.String(description='Exception class of the error that failed the job'),
+    'error': fields.String(description='Error message if the job failed'),
+    'items': fields.List(fields.Nested(api.model('BulkIngestItem', {
+        'url': fields.String(description='URL the video came from'),
+        'video_id': fields.String(description='YouTube video ID'),
+        'title': fields.String(description='Video title'),
+        'status': fields.String(required=True, description='pending, skipped, in_progress, requeued, completed, failed, invalid, or partial for a playlist only partly listed before the quota ran out'),
+        'error_class': fields.String(description='Exception class of the last error'),
+        'error': fields.String(description='Error message if the item failed')
+    })))
+})
+
 # Initialize the S3 client
 session = boto3.Session(profile_name='knowledge-collector')
 s3 = session.client('s3', region_name='us-west-2')
@@ -81,22 +126,194 @@ BUCKET_NAME = 'jmhudak-knowledge-collector'  # Replace with your S3 bucket name
 
 # Global dictionary to store job statuses and results
 jobs = {}
+jobs_lock = threading.Lock()
+
+# Transcript fetches share one adaptive concurrency limit and circuit breaker,
+# since YouTube throttles by IP rather than by job
+# BULK_INGEST_WORKERS set the bulk ingest pool size before the shared limit and is
+# still honoured as its starting value
+transcript_limiter = AdaptiveLimiter(
+    initial=int(os.getenv('TRANSCRIPT_CONCURRENCY', os.getenv('BULK_INGEST_WORKERS', 4))),
+    maximum=int(os.getenv('TRANSCRIPT_MAX_CONCURRENCY', 16))
+)
+transcript_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv('TRANSCRIPT_BREAKER_THRESHOLD', 3)),
+    reset_timeout=int(os.getenv('TRANSCRIPT_BREAKER_TIMEOUT', 60))
+)
+
+def youtube_transcript_request():
+    """Hold a slot of the shared limit for one request to YouTube's transcript endpoints"""
+    return guarded_request(transcript_limiter, transcript_breaker)
+
+# Estimated Jaccard similarity above which a transcript is a near-duplicate
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', 0.8))
+DEDUP_INDEX_PREFIX = 'cache/dedup/minhash'
+
+# One index per threshold, since the LSH bands depend on it
+dedup_indexes = {}
+
+# Token-aware packing of training data into fixed-length sequences
+PACK_SEQUENCE_LENGTH = int(os.getenv('PACK_SEQUENCE_LENGTH', 2048))
+PACK_OVERLAP = int(os.getenv('PACK_OVERLAP', 0))
+PACK_SEPARATOR = os.getenv('PACK_SEPARATOR', '<|endoftext|>')
+PACK_MAX_OPEN_BINS = int(os.getenv('PACK_MAX_OPEN_BINS', 64))
+PACK_SHARD_SIZE = int(os.getenv('PACK_SHARD_SIZE', 10000))
+PACK_ENCODING = os.getenv('PACK_ENCODING', 'cl100k_base')
+
+def megabytes(name):
+    """Read a size in MB from the environment as bytes, None if unset"""
+    value = os.getenv(name)
+    return int(float(value) * 1024 * 1024) if value else None
+
+# Keep regenerable artifacts within their disk budgets, evicting the least
+# recently used audio and then translations in the background
+storage_manager = StorageManager(
+    storage.root,
+    budgets={
+        'audio': megabytes('STORAGE_BUDGET_AUDIO_MB'),
+        'translation': megabytes('STORAGE_BUDGET_TRANSLATION_MB'),
+        'total': megabytes('STORAGE_BUDGET_TOTAL_MB')
+    },
+    interval=int(os.getenv('STORAGE_EVICTION_INTERVAL', 300)),
+    in_use=lambda path: audio_broadcaster.is_generating(path)
+)
+storage_manager.start()
+
+def pin_files(paths):
+    """Protect files from eviction while they are served.
+
+    Returns a function that releases them, to be passed to call_on_close.
+    """
+    for path in paths:
+        storage_manager.pin(path)
+        storage_manager.record_access(path)
+
+    def release():
+        for path in paths:
+            storage_manager.unpin(path)
+    return release
+
+# Track YouTube Data API usage against the daily quota
+# The state lives in shared storage, so every node spends from the same budget
+quota = QuotaScheduler(
+    storage,
+    'quota.json',
+    daily_limit=int(os.getenv('YOUTUBE_DAILY_QUOTA', 10000)),
+    background_reserve=int(os.getenv('YOUTUBE_QUOTA_RESERVE', 1000))
+)
+
+# Search responses are cached in memory so repeated lookups cost no quota
+search_service = SearchService(
+    quota,
+    ttl=int(os.getenv('SEARCH_CACHE_TTL', 3600)),
+    max_entries=int(os.getenv('SEARCH_CACHE_SIZE', 256))
+)
+
+def read_json(key):
+    """Read a JSON artifact from storage, None if it doesn't exist"""
+    path = storage.local_path(key)
+    if path is None:
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_json(key, data, **kwargs):
+    """Write a JSON artifact to storage"""
+    storage.write_text(key, json.dumps(data, **kwargs))
+
+def search_cache_key(query, page_token=None):
+    """Storage key of the cached search results for a page of a query"""
+    key = f"{' '.join(query.lower().split())}\0{page_token or ''}"
+    query_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return f"cache/search/{query_hash}.json"
+
+def search_videos(query, page_token=None, priority=INTERACTIVE):
+    """Search YouTube, falling back to cached results when the quota runs low.
+
+    Returns the page's results and the token of the next page.
+    """
+    cache_key = search_cache_key(query, page_token)
 
-def fetch_transcripts(channel_name, author=None):
+    try:
+        search_response, fetched = search_service.search_with_status(query, page_token, priority)
+    except QuotaExceeded as e:
+        print(f"{e}. Falling back to cached search results")
+        cached = read_json(cache_key)
+        if cached is not None:
+            return cached['results'], cached['next_page_token']
+        raise
+
+    if search_response is None:
+        return None, None
+
+    search_results = display_yt_results(search_response)
+    # Only a fresh response can change the fallback copy
+    if fetched and search_results is not None:
+        write_json(cache_key, {'results': search_results, 'next_page_token': search_response.next_page_token})
+    return search_results, search_response.next_page_token
+
+def video_metadata_key(video_id):
+    """Storage key of the cached details for a video"""
+    return f"transcripts/{video_id}/metadata.json"
+
+def get_videos_details(video_ids, priority=INTERACTIVE):
+    """Get the title and author of many videos, keyed by video ID.
+
+    Details are cached next to the transcript so repeated page views don't
+    spend quota on videos.list. Uncached videos are looked up 50 at a time,
+    which is the most a single videos.list call accepts.
+    """
+    details = {}
+    missing = []
+    for video_id in video_ids:
+        metadata = read_json(video_metadata_key(video_id))
+        if metadata is not None:
+            details[video_id] = (metadata['title'], metadata['author'])
+        else:
+            missing.append(video_id)
+
+    for i in range(0, len(missing), 50):
+        batch = missing[i:i + 50]
+        try:
+            video_response = quota.execute(
+                'videos.list',
+                lambda: youtube.videos().list(part='snippet', id=','.join(batch), maxResults=50).execute(),
+                priority
+            )
+        except QuotaExceeded as e:
+            print(f"{e}. No cached details for {len(missing) - i} videos")
+            break
+
+        for item in video_response['items']:
+            video_id = item['id']
+            title = item['snippet']['title']
+            author = item['snippet']['channelTitle']
+            details[video_id] = (title, author)
+
+            write_json(video_metadata_key(video_id), {'video_id': video_id, 'title': title, 'author': author})
+
+    for video_id in video_ids:
+        details.setdefault(video_id, ("Unknown Title", "Unknown Author"))
+    return details
+
+def get_video_details(video_id, priority=INTERACTIVE):
+    """Get the title and author of a video"""
+    return get_videos_details([video_id], priority)[video_id]
+
+def fetch_transcripts(channel_name, author=None, priority=INTERACTIVE, page_token=None):
     try:
         print(f"CHANNEL NAME {channel_name}")
 
-        search_response = search_yt(channel_name)
-        if search_response is None:
-            print("search_yt returned None")
-            return {"error": "No search results found"}, 404
+        try:
+            search_results, next_page_token = search_videos(channel_name, page_token, priority)
+        except QuotaExceeded as e:
+            return {"error": str(e)}, 429
 
-        search_results = display_yt_results(search_response)
         if search_results is None:
-            print("display_yt_results returned None")
-            return {"error": "Failed to process search results"}, 500
+            print("search_videos returned None")
+            return {"error": "No search results found"}, 404
 
-        print(f"Search results: {search_results}")  # Debug print
+        print(f"Search returned {len(search_results)} results")  # Debug print
 
         # Filter videos by author matching channel_name
         filtered_results = [
@@ -117,52 +334,100 @@ def fetch_transcripts(channel_name, author=None):
         return {
             "job_id": job_id,
             "message": "Transcription job started",
-            "total_videos": len(filtered_results)
+            "total_videos": len(filtered_results),
+            "next_page_token": next_page_token
         }, 202
 
     except Exception as e:
         print(f"Error fetching transcripts: {e}")
         return {"error": str(e)}, 500
 
+def pause_job(job_id, seconds):
+    """Mark a job as paused while the circuit breaker is open"""
+    print(f"Pausing job {job_id} for {seconds:.0f}s while YouTube is throttling us")
+    jobs[job_id]['status'] = 'paused'
+    jobs[job_id]['resumes_at'] = time.time() + seconds
+
+def resume_job(job_id):
+    """Mark a paused job as running again"""
+    print(f"Resuming job {job_id}")
+    jobs[job_id]['status'] = 'in_progress'
+    jobs[job_id].pop('resumes_at', None)
+
+def run_job_with_backoff(job_id, items, work, on_failure):
+    """Run a job's items under the shared limiter and circuit breaker.
+
+    Throttled items are requeued with their error class recorded in the job's
+    `errors`, and `on_failure(item, exc)` is called for items that are given up on.
+    """
+    job = jobs[job_id]
+    job.setdefault('errors', [])
+    job.setdefault('requeued', 0)
+
+    def on_error(item, exc, requeued):
+        with jobs_lock:
+            job['errors'].append({
+                'video_id': item['video_id'],
+                'error_class': error_class(exc),
+                'error': str(exc),
+                'requeued': requeued
+            })
+            if requeued:
+                job['requeued'] += 1
+        if not requeued:
+            on_failure(item, exc)
+
+    run_with_backoff(
+        items, work, transcript_breaker, on_error,
+        on_pause=lambda seconds: pause_job(job_id, seconds),
+        on_resume=lambda: resume_job(job_id),
+        max_workers=transcript_limiter.maximum
+    )
+
 def process_transcripts(job_id, videos, channel_name):
     jobs[job_id] = {
         'job_id': job_id,
         'status': 'in_progress',
         'total_videos': len(videos),
         'processed_videos': 0,
-        'results': []
+        'results': [],
+        'failed': []
     }
 
-    for video in videos:
-        try:
-            video_id = video['video_id']
-            cache_dir = os.path.join('storage/cache', channel_name)
-            os.makedirs(cache_dir, exist_ok=True)
-            cache_file_path = os.path.join(cache_dir, f"{video_id}.json")
-
-            if os.path.exists(cache_file_path):
-                # Load transcript from cache if it exists
-                with open(cache_file_path, 'r') as cache_file:
-                    transcript_data = json.load(cache_file)
-                    transcript = transcript_data['transcript']
-            else:
-                # Fetch and process the transcript
+    def process_video(video):
+        video_id = video['video_id']
+        cache_key = f"cache/{channel_name}/{video_id}.json"
+
+        transcript_data = read_json(cache_key)
+        if transcript_data is not None:
+            # Load transcript from cache if it exists
+            transcript = transcript_data['transcript']
+        else:
+            # Fetch and process the transcript
+            with youtube_transcript_request():
                 transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
-                transcript = " ".join([t['text'] for t in transcript_list])
-                
-                # Save the transcript to cache
-                with open(cache_file_path, 'w') as cache_file:
-                    json.dump({'transcript': transcript}, cache_file)
-
-            jobs[job_id]['results'].append({
-                'video_id': video_id,
-                'title': video['title'],
-                'transcript': transcript
-            })
+            transcript = " ".join([t['text'] for t in transcript_list])
+            
+            # Save the transcript to cache
+            write_json(cache_key, {'transcript': transcript})
+
+        jobs[job_id]['results'].append({
+            'video_id': video_id,
+            'title': video['title'],
+            'transcript': transcript
+        })
+        with jobs_lock:
             jobs[job_id]['processed_videos'] += 1
 
-        except Exception as e:
-            print(f"Error processing video {video['video_id']}: {e}")
+    def record_failure(video, exc):
+        print(f"Error processing video {video['video_id']}: {exc}")
+        jobs[job_id]['failed'].append({
+            'video_id': video['video_id'],
+            'error_class': error_class(exc),
+            'error': str(exc)
+        })
+
+    run_job_with_backoff(job_id, videos, process_video, record_failure)
 
     jobs[job_id]['status'] = 'completed'
 
@@ -186,25 +451,28 @@ def check_job_status(job_id):
 
 @ns_transcripts.route('/')
 class TranscriptList(Resource):
-    @api.doc(params={'channel_name': 'YouTube channel name', 'author': 'YouTube author name'})
+    @api.doc(params={'channel_name': 'YouTube channel name', 'author': 'YouTube author name',
+                      'page_token': 'Token of the search results page to use'})
     @api.response(200, 'Success', [transcript_model])
     def get(self):
         """Fetch transcripts for a given channel"""
         channel_name = request.args.get('channel_name')
         author = request.args.get('author')
+        page_token = request.args.get('page_token')
         if not channel_name:
             api.abort(400, "Please provide a channel name.")
 
-        return fetch_transcripts(channel_name, author)
+        return fetch_transcripts(channel_name, author, page_token=page_token)
 
 @app.route('/transcripts', methods=['GET'])
 def get_transcripts():
     channel_name = request.args.get('channel_name')
     author = request.args.get('author')
+    page_token = request.args.get('page_token')
     if not channel_name:
         return jsonify({"error": "Please provide a channel name."}), 400
 
-    return fetch_transcripts(channel_name, author)
+    return fetch_transcripts(channel_name, author, page_token=page_token)
 
 @app.route('/')
 def index():
@@ -215,28 +483,53 @@ def index():
         transcripts, _ = fetch_transcripts(channel_name, author)
     return render_template('index.html', transcripts=transcripts)
 
-def prepare_finetuning_data(channel_name):
+def get_dedup_index(threshold=DEDUP_THRESHOLD):
+    """Get the near-duplicate index shared by all channels"""
+    if threshold not in dedup_indexes:
+        dedup_indexes[threshold] = MinHashIndex(storage, DEDUP_INDEX_PREFIX, threshold)
+    return dedup_indexes[threshold]
+
+def get_uploads_playlist_id(channel_name, priority=BACKGROUND):
+    """Find the uploads playlist of a channel by its legacy username or its @handle"""
+    for lookup in ({'forUsername': channel_name}, {'forHandle': channel_name}):
+        channel_response = quota.execute(
+            'channels.list',
+            lambda: youtube.channels().list(part='contentDetails', **lookup).execute(),
+            priority
+        )
+        if channel_response.get('items'):
+            return channel_response['items'][0]['contentDetails']['relatedPlaylists']['uploads']
+    return None
+
+def prepare_finetuning_data(channel_name, dedup_threshold=DEDUP_THRESHOLD):
+    """Write a channel's transcripts to training_data.jsonl, leaving out near-duplicates.
+
+    Returns a summary of the run, or None if it failed.
+    """
     try:
         print(f"CHANNEL NAME: {channel_name}")
-        channel_info = api.get_channel_info(for_username=channel_name)
-        playlist_id = channel_info.items[0].contentDetails.relatedPlaylists.uploads
-        playlist_items = api.get_playlist_items(playlist_id=playlist_id, count=None)
+        playlist_id = get_uploads_playlist_id(channel_name)
+        if playlist_id is None:
+            print(f"Channel not found: {channel_name}")
+            return None
+        video_ids = get_playlist_video_ids(playlist_id)
 
-        # Prepare the output file path
-        training_data_file = os.path.join('storage/cache', channel_name, 'training_data.jsonl')
-        os.makedirs(os.path.dirname(training_data_file), exist_ok=True)
+        # Prepare the output file keys
+        training_data_file = f"cache/{channel_name}/training_data.jsonl"
+        duplicates_file = f"cache/{channel_name}/duplicates.json"
 
-        # Open the output file
-        with open(training_data_file, 'w', encoding='utf-8') as f:
-            for item in playlist_items.items:
-                video_id = item.contentDetails.videoId
+        # Near-duplicates are checked against everything collected so far, not just this channel
+        dedup_index = get_dedup_index(dedup_threshold)
+        duplicate_pairs = []
+        records = 0
 
+        # Open the output file
+        with storage.open_write(training_data_file, 'w', encoding='utf-8') as f:
+            for video_id in video_ids:
                 # Check if the transcript is cached
-                cache_file_path = os.path.join('storage/cache', channel_name, f"{video_id}.json")
-                if os.path.exists(cache_file_path):
-                    with open(cache_file_path, 'r') as cache_file:
-                        transcript_data = json.load(cache_file)
-                        transcript = transcript_data['transcript']
+                transcript_data = read_json(f"cache/{channel_name}/{video_id}.json")
+                if transcript_data is not None:
+                    transcript = transcript_data['transcript']
                 else:
                     # Fetch the transcript for the video if not cached
                     try:
@@ -246,6 +539,14 @@ def prepare_finetuning_data(channel_name):
                         print(f"Could not fetch transcript for video ID {video_id}: {e}")
                         continue
 
+                # Skip re-uploads, compilations and other near-duplicates
+                duplicates = dedup_index.add(video_id, transcript)
+                if duplicates:
+                    original_id, similarity = duplicates[0]
+                    print(f"Skipping video ID {video_id}: {similarity:.0%} similar to {original_id}")
+                    duplicate_pairs.append((video_id, original_id))
+                    continue
+
                 # Prepare the JSON object for fine-tuning
                 data = {
                     "input": transcript,  # Transcript of the video
@@ -254,30 +555,80 @@ def prepare_finetuning_data(channel_name):
 
                 # Write the JSON object as a new line in the output file
                 f.write(json.dumps(data) + "\n")
+                records += 1
 
         print(f"Fine-tuning data saved to {training_data_file}")
 
+        # Report the duplicate clusters found in this run
+        write_json(duplicates_file, {
+            'threshold': dedup_threshold,
+            'skipped': len(duplicate_pairs),
+            'clusters': duplicate_clusters(duplicate_pairs)
+        }, indent=2)
+        print(f"Skipped {len(duplicate_pairs)} near-duplicate transcripts, see {duplicates_file}")
+
+        return {
+            'channel_name': channel_name,
+            'videos': len(video_ids),
+            'records': records,
+            'skipped_duplicates': len(duplicate_pairs)
+        }
+
     except Exception as e:
         print(f"Error preparing fine-tuning data: {e}")
-        return []
+        return None
+
+def pack_training_data(channel_name, sequence_length=PACK_SEQUENCE_LENGTH, overlap=PACK_OVERLAP):
+    """Split a channel's training data into token-bounded samples and pack them
+    into fixed-length sequences, written as shards under cache/<channel>/packed"""
+    training_data_file = storage.local_path(f"cache/{channel_name}/training_data.jsonl")
+    if training_data_file is None:
+        return None
+
+    packer = SequencePacker(
+        sequence_length=sequence_length,
+        overlap=overlap,
+        separator=PACK_SEPARATOR,
+        max_open_bins=PACK_MAX_OPEN_BINS,
+        encoding_name=PACK_ENCODING
+    )
+
+    def training_texts():
+        # Read one record at a time so memory doesn't grow with the file
+        with open(training_data_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if record.get('input'):
+                        yield record['input']
+
+    with storage_manager.pinned(training_data_file):
+        totals = write_shards(
+            packer.pack(training_texts()),
+            storage,
+            f"cache/{channel_name}/packed",
+            sequence_length,
+            PACK_SHARD_SIZE
+        )
+    totals['split_records'] = packer.split_records
+    print(f"Packed {totals['samples']} samples into {totals['sequences']} sequences "
+          f"({totals['fill_ratio']:.1%} full) for {channel_name}")
+    return totals
 
 @app.route('/training_data', methods=['GET'])
 def list_training_data():
     # Get the list of channels from the cache directory
-    cache_dir = 'storage/cache'
     channels = []
 
     # Iterate through the cache directory to find training_data.jsonl files
-    for channel_name in os.listdir(cache_dir):
-        training_data_file = os.path.join(cache_dir, channel_name, 'training_data.jsonl')
-        if os.path.isfile(training_data_file):
+    for channel_name in storage.list_dirs('cache'):
+        if 'training_data.jsonl' in storage.list_files(f"cache/{channel_name}"):
             channels.append(channel_name)
 
     return render_template('training_data.html', channels=channels)
 
 @app.route('/sync_training_data', methods=['POST'])
 def sync_training_data():
-    cache_dir = 'storage/cache'
     try:
         # Check if the bucket exists, if not, create it
         if not bucket_exists(BUCKET_NAME):
@@ -285,10 +636,10 @@ def sync_training_data():
                 'LocationConstraint': 'us-west-2'})  # Specify the region
 
         # Iterate through the cache directory to find training_data.jsonl files
-        for channel_name in os.listdir(cache_dir):
+        for channel_name in storage.list_dirs('cache'):
             print(f"channel_name {channel_name}")
-            training_data_file = os.path.join(cache_dir, channel_name, 'training_data.jsonl')
-            if os.path.isfile(training_data_file):
+            training_data_file = storage.local_path(f"cache/{channel_name}/training_data.jsonl")
+            if training_data_file is not None:
                 # Upload the training data file to S3
                 s3.upload_file(training_data_file, BUCKET_NAME, f"{channel_name}/training_data.jsonl")
         
@@ -322,6 +673,35 @@ class SyncTrainingData(Resource):
         except Exception as e:
             api.abort(500, f"An error occurred: {str(e)}")
 
+@ns_training.route('/duplicates/<string:channel_name>')
+class TrainingDuplicates(Resource):
+    @api.doc(params={'channel_name': 'YouTube channel name'})
+    @api.response(200, 'Success')
+    @api.response(404, 'No duplicate report for channel')
+    def get(self, channel_name):
+        """Get the near-duplicate clusters skipped when preparing a channel's training data"""
+        duplicates = read_json(f"cache/{channel_name}/duplicates.json")
+        if duplicates is None:
+            api.abort(404, f"No duplicate report for {channel_name}")
+        return duplicates
+
+@ns_training.route('/packed/<string:channel_name>')
+class PackedTrainingData(Resource):
+    @api.doc(params={'channel_name': 'YouTube channel name'})
+    @api.response(200, 'Success')
+    @api.response(404, 'No packed training data for channel')
+    def get(self, channel_name):
+        """Get the token statistics of each shard of a channel's packed training data"""
+        prefix = f"cache/{channel_name}/packed"
+        shards = {
+            file_name[:-len('.stats.json')]: read_json(f"{prefix}/{file_name}")
+            for file_name in storage.list_files(prefix)
+            if file_name.endswith('.stats.json')
+        }
+        if not shards:
+            api.abort(404, f"No packed training data for {channel_name}")
+        return shards
+
 @ns_jobs.route('/<string:job_id>')
 class Job(Resource):
     @api.doc(params={'job_id': 'Unique job identifier'})
@@ -349,6 +729,22 @@ class JobList(Resource):
         job_list = list(jobs.values())[start:end]
         return job_list
 
+@ns_quota.route('/')
+class QuotaUsage(Resource):
+    @api.response(200, 'Success')
+    def get(self):
+        """Get today's YouTube Data API quota usage"""
+        usage = quota.usage()
+        usage['search_cache'] = search_service.stats()
+        return usage
+
+@ns_storage.route('/')
+class StorageUsage(Resource):
+    @api.response(200, 'Success')
+    def get(self):
+        """Get disk usage and budgets of cached transcripts, translations and audio"""
+        return storage_manager.usage()
+
 def extract_video_id(url):
     """Extract video ID from various forms of YouTube URLs"""
     parsed_url = urlparse(url)
@@ -361,6 +757,39 @@ def extract_video_id(url):
         return parsed_url.path[1:]
     return None
 
+def extract_playlist_id(url):
+    """Extract playlist ID from a YouTube playlist URL"""
+    parsed_url = urlparse(url)
+    if parsed_url.hostname in ('www.youtube.com', 'youtube.com', 'm.youtube.com') and parsed_url.path == '/playlist':
+        return parse_qs(parsed_url.query).get('list', [None])[0]
+    return None
+
+def get_playlist_video_ids(playlist_id, priority=BACKGROUND):
+    """List the video IDs of a playlist, 50 per playlistItems.list call"""
+    video_ids = []
+    page_token = None
+    while True:
+        try:
+            playlist_response = quota.execute(
+                'playlistItems.list',
+                lambda: youtube.playlistItems().list(
+                    part='contentDetails',
+                    playlistId=playlist_id,
+                    maxResults=50,
+                    pageToken=page_token
+                ).execute(),
+                priority
+            )
+        except QuotaExceeded as e:
+            # Let the caller keep the pages that were already paid for
+            e.video_ids = video_ids
+            raise
+        video_ids.extend(item['contentDetails']['videoId'] for item in playlist_response['items'])
+
+        page_token = playlist_response.get('nextPageToken')
+        if not page_token:
+            return video_ids
+
 def translate_with_claude(text, target_language="English"):
     """Translate text using Claude with improved formatting and chunking"""
     try:
@@ -490,7 +919,183 @@ def detect_language_with_claude(text):
         print(f"Language detection error: {e}")
         return "Unknown"
 
-def fetch_single_transcript(video_url, translate=False):
+# Translation tiers tried in order by each strategy. 'manual' uses an English
+# caption track uploaded by the creator, 'youtube' uses YouTube's machine
+# translation of the captions and 'claude' translates the text with Claude.
+TRANSLATION_STRATEGIES = {
+    'auto': ['manual', 'youtube', 'claude'],
+    'youtube': ['manual', 'youtube'],
+    'claude': ['claude'],
+}
+
+TRANSCRIPT_LANGUAGES = ['en', 'es', 'fr', 'de', 'it', 'pt', 'ru', 'ja', 'ko', 'zh']
+
+def find_source_transcript(transcript_list, translate=False):
+    """Pick the caption track to store as a video's original transcript.
+
+    Without translation the first of TRANSCRIPT_LANGUAGES wins, English
+    included. When a translation is wanted the track in the spoken language
+    is used instead, taken from YouTube's automatic captions. Otherwise a
+    video with English subtitles would be stored in English and never
+    translated.
+    """
+    if translate:
+        spoken = [track.language_code for track in transcript_list if track.is_generated]
+        if spoken:
+            # find_transcript prefers a manually created track in that language
+            return transcript_list.find_transcript(spoken[:1])
+    return transcript_list.find_transcript(TRANSCRIPT_LANGUAGES)
+
+# youtube-transcript-api errors meaning a video has no usable track, as opposed to
+# YouTube failing or throttling us. Matched by name like concurrency.THROTTLE_ERRORS.
+MISSING_TRACK_ERRORS = {
+    'NoTranscriptFound', 'NoTranscriptAvailable', 'TranscriptsDisabled',
+    'NotTranslatable', 'TranslationLanguageNotAvailable'
+}
+
+def translate_from_youtube(transcript_list, tier):
+    """Get English captions from YouTube itself, or None if the tier has none"""
+    if tier == 'manual':
+        try:
+            english = transcript_list.find_manually_created_transcript(['en'])
+        except Exception as e:
+            if error_class(e) in MISSING_TRACK_ERRORS:
+                return None
+            raise
+    else:
+        source = find_source_transcript(transcript_list, translate=True)
+        if not source.is_translatable or not any(
+                language['language_code'] == 'en' for language in source.translation_languages):
+            return None
+        english = source.translate('en')
+
+    with youtube_transcript_request():
+        captions = english.fetch()
+    return " ".join([t['text'] for t in captions])
+
+def translate_transcript(video_id, title, transcript_text, strategy='auto', transcript_list=None):
+    """Translate a transcript with the cheapest tier of the strategy that works.
+
+    Returns the translated title, translated transcript and the tier used,
+    or None for all three if every tier failed.
+    """
+    for tier in TRANSLATION_STRATEGIES[strategy]:
+        try:
+            if tier == 'claude':
+                print("Requesting new translation from Claude")
+                # Translate title and transcript separately
+                translated_title = translate_with_claude(title)
+                translated_transcript = translate_with_claude(transcript_text)
+                if translated_title and translated_transcript:
+                    return translated_title, translated_transcript, tier
+            else:
+                if transcript_list is None:
+                    with youtube_transcript_request():
+                        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
+                translated_transcript = translate_from_youtube(transcript_list, tier)
+                if translated_transcript:
+                    print(f"Using YouTube {tier} English captions for {video_id}")
+                    # Keep the original title rather than spending an LLM call on it
+                    return title, translated_transcript, tier
+        except Exception as e:
+            # Only a missing or untranslatable track moves on to the next tier.
+            # Throttling must reach the circuit breaker rather than quietly
+            # falling through to the paid Claude tier.
+            if tier != 'claude' and (is_throttle_error(e) or error_class(e) not in MISSING_TRACK_ERRORS):
+                raise
+            print(f"Translation tier {tier} failed for {video_id}: {e}")
+
+    return None, None, None
+
+def store_transcript(video_id, title, author, translate=False, translation_strategy='auto'):
+    """Fetch, cache and optionally translate the transcript of a video"""
+    original_cache_key = f"transcripts/{video_id}/original.txt"
+    translated_cache_key = f"transcripts/{video_id}/translated.txt"
+    info_key = f"transcripts/{video_id}/transcript_info.json"
+
+    # Languages and translation tiers of earlier runs
+    info = read_json(info_key) or {}
+
+    # Get transcript content
+    transcript_list = None
+    if storage.exists(original_cache_key):
+        original_text = storage.read_text(original_cache_key)
+        transcript_text = original_text.split('\n\n', 1)[1] if '\n\n' in original_text else original_text
+        original_language = info.get('original_language', 'cached')
+    else:
+        with youtube_transcript_request():
+            transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
+        transcript = find_source_transcript(transcript_list, translate)
+        with youtube_transcript_request():
+            transcript_data = transcript.fetch()
+        transcript_text = " ".join([t['text'] for t in transcript_data])
+        original_language = transcript.language_code
+        info['original_language'] = original_language
+
+        # Format original with header
+        original_text = f"""Title: {title}
+Author: {author}
+
+{transcript_text}"""
+
+        # Save original
+        write_transcript(storage, original_cache_key, original_text)
+
+    # Handle translation if requested
+    translated_text = None
+    translation_tier = None
+    if translate and original_language != 'en':
+        print(f"Translation requested. Original language: {original_language}, strategy: {translation_strategy}")
+
+        # Check if translation exists and needs updating
+        if storage.exists(translated_cache_key):
+            print("Checking cached translation")
+            translated_text = storage.read_text(translated_cache_key)
+            translation_tier = info.get('translation_tier', 'cached')
+
+            # Check if the cached translation needs updating
+            if not translated_text.startswith("Title:"):
+                print("Adding title to cached translation")
+                # Translate just the title
+                translated_title = translate_with_claude(title)
+                if translated_title:
+                    # Prepend title and author to existing translation
+                    translated_text = f"Title: {translated_title}\nAuthor: {author}\n\n{translated_text}"
+                    # Update the cache file
+                    write_transcript(storage, translated_cache_key, translated_text)
+        else:
+            translated_title, translated_transcript, translation_tier = translate_transcript(
+                video_id, title, transcript_text, translation_strategy, transcript_list)
+
+            if translated_transcript:
+                translated_text = f"Title: {translated_title}\nAuthor: {author}\n\n{translated_transcript}"
+                write_transcript(storage, translated_cache_key, translated_text)
+                info['translation_tier'] = translation_tier
+    else:
+        print(f"Translation not needed. translate_to_english: {translate}, original_language: {original_language}")
+
+    write_json(info_key, info)
+
+    # Create response with download URLs
+    response = {
+        "video_id": video_id,
+        "title": title,
+        "author": author,
+        "transcript": original_text,
+        "original_language": original_language,
+        "download_urls": {
+            "original": f"/download/{video_id}/original",
+        }
+    }
+
+    if translated_text:
+        response["translated_transcript"] = translated_text
+        response["translation_tier"] = translation_tier
+        response["download_urls"]["translated"] = f"/download/{video_id}/translated"
+
+    return response
+
+def fetch_single_transcript(video_url, translate=False, translation_strategy='auto'):
     try:
         video_id = extract_video_id(video_url)
         if not video_id:
@@ -498,132 +1103,177 @@ def fetch_single_transcript(video_url, translate=False):
 
         try:
             # Get video details first
-            video_response = youtube.videos().list(
-                part='snippet',
-                id=video_id
-            ).execute()
-            
-            if video_response['items']:
-                video_info = video_response['items'][0]['snippet']
-                title = video_info['title']
-                author = video_info['channelTitle']
-            else:
-                title = "Unknown Title"
-                author = "Unknown Author"
-
-            cache_dir = os.path.join('storage', 'transcripts', video_id)
-            os.makedirs(cache_dir, exist_ok=True)
-            
-            original_cache_path = os.path.join(cache_dir, 'original.txt')
-            translated_cache_path = os.path.join(cache_dir, 'translated.txt')
-            
-            # Get transcript content
-            if os.path.exists(original_cache_path):
-                with open(original_cache_path, 'r', encoding='utf-8') as f:
-                    original_text = f.read()
-                    transcript_text = original_text.split('\n\n', 1)[1] if '\n\n' in original_text else original_text
-                    original_language = 'cached'
-            else:
-                transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-                transcript = transcript_list.find_transcript(['en', 'es', 'fr', 'de', 'it', 'pt', 'ru', 'ja', 'ko', 'zh'])
-                transcript_data = transcript.fetch()
-                transcript_text = " ".join([t['text'] for t in transcript_data])
-                original_language = transcript.language_code
-                
-                # Format original with header
-                original_text = f"""Title: {title}
-Author: {author}
-
-{transcript_text}"""
-                
-                # Save original
-                with open(original_cache_path, 'w', encoding='utf-8') as f:
-                    f.write(original_text)
-            
-            # Handle translation if requested
-            if translate and original_language != 'en':
-                print(f"Translation requested. Original language: {original_language}")
-                translated_text = None
-                
-                # Check if translation exists and needs updating
-                if os.path.exists(translated_cache_path):
-                    print("Checking cached translation")
-                    with open(translated_cache_path, 'r', encoding='utf-8') as f:
-                        translated_text = f.read()
-                    
-                    # Check if the cached translation needs updating
-                    if not translated_text.startswith("Title:"):
-                        print("Adding title to cached translation")
-                        # Translate just the title
-                        translated_title = translate_with_claude(title)
-                        if translated_title:
-                            # Prepend title and author to existing translation
-                            translated_text = f"Title: {translated_title}\nAuthor: {author}\n\n{translated_text}"
-                            # Update the cache file
-                            with open(translated_cache_path, 'w', encoding='utf-8') as f:
-                                f.write(translated_text)
-                else:
-                    print("Requesting new translation from Claude")
-                    # Translate title and transcript separately
-                    translated_title = translate_with_claude(title)
-                    translated_transcript = translate_with_claude(transcript_text)
-                    
-                    if translated_title and translated_transcript:
-                        translated_text = f"Title: {translated_title}\nAuthor: {author}\n\n{translated_transcript}"
-                        with open(translated_cache_path, 'w', encoding='utf-8') as f:
-                            f.write(translated_text)
-                    else:
-                        translated_text = None
-            else:
-                print(f"Translation not needed. translate_to_english: {translate}, original_language: {original_language}")
-            
-            # Create response with download URLs
-            response = {
-                "video_id": video_id,
-                "title": title,
-                "author": author,
-                "transcript": original_text,
-                "url": video_url,
-                "original_language": original_language,
-                "download_urls": {
-                    "original": f"/download/{video_id}/original",
-                }
-            }
-            
-            if translated_text:
-                response["translated_transcript"] = translated_text
-                response["download_urls"]["translated"] = f"/download/{video_id}/translated"
+            title, author = get_video_details(video_id)
 
+            response = store_transcript(video_id, title, author, translate, translation_strategy)
+            response["url"] = video_url
             return response, 200
 
+        except BreakerOpen:
+            return {"error": "YouTube is throttling transcript requests, try again later"}, 503
         except Exception as e:
             return {"error": f"Failed to fetch transcript: {str(e)}"}, 500
 
     except Exception as e:
         return {"error": str(e)}, 500
 
+def is_transcript_stored(video_id, translate=False):
+    """Check whether a video's transcript (and translation if wanted) is already stored"""
+    if not storage.exists(f"transcripts/{video_id}/original.txt"):
+        return False
+    return not translate or storage.exists(f"transcripts/{video_id}/translated.txt")
+
+def create_bulk_ingest_job():
+    """Register a bulk ingestion job and return its ID"""
+    job_id = str(uuid.uuid4())
+    jobs[job_id] = {
+        'job_id': job_id,
+        'type': 'bulk_ingest',
+        'status': 'pending',
+        'total_videos': 0,
+        'processed_videos': 0,
+        'items': []
+    }
+    return job_id
+
+def process_bulk_ingest(job_id, urls, translate=False, force=False, translation_strategy='auto'):
+    """Resolve URLs to videos and ingest them all as one job"""
+    job = jobs[job_id]
+    job['status'] = 'in_progress'
+
+    try:
+        # Resolve every URL to video IDs, expanding playlists and dropping duplicates
+        items = {}
+        for url in urls:
+            url = url.strip()
+            if not url:
+                continue
+
+            playlist_id = extract_playlist_id(url)
+            if playlist_id:
+                try:
+                    video_ids = get_playlist_video_ids(playlist_id)
+                except QuotaExceeded as e:
+                    # Ingest what was listed before the quota ran out
+                    video_ids = e.video_ids
+                    print(f"{e}. Ingesting the first {len(video_ids)} videos of playlist {playlist_id}")
+                    job['items'].append({'url': url, 'status': 'partial', 'error_class': error_class(e), 'error': str(e)})
+                except Exception as e:
+                    print(f"Error listing playlist {playlist_id}: {e}")
+                    job['items'].append({'url': url, 'status': 'invalid', 'error': str(e)})
+                    continue
+            else:
+                video_id = extract_video_id(url)
+                if not video_id:
+                    job['items'].append({'url': url, 'status': 'invalid', 'error': 'Invalid YouTube URL'})
+                    continue
+                video_ids = [video_id]
+
+            for video_id in video_ids:
+                if video_id in items:
+                    continue
+                item = {'url': url, 'video_id': video_id, 'status': 'pending'}
+                if not force and is_transcript_stored(video_id, translate):
+                    item['status'] = 'skipped'
+                items[video_id] = item
+                job['items'].append(item)
+
+        pending = [item for item in items.values() if item['status'] == 'pending']
+        job['total_videos'] = len(pending)
+        print(f"Bulk ingest {job_id}: {len(pending)} videos to fetch, {len(items) - len(pending)} already stored")
+
+        # Look up titles and authors in batches instead of once per video
+        details = get_videos_details([item['video_id'] for item in pending], BACKGROUND)
+
+        def ingest(item):
+            title, author = details[item['video_id']]
+            item['title'] = title
+            item['status'] = 'in_progress'
+            try:
+                store_transcript(item['video_id'], title, author, translate, translation_strategy)
+            except Exception as e:
+                # Record the error class so requeued items show why they're waiting
+                item['status'] = 'requeued'
+                item['error_class'] = error_class(e)
+                item['error'] = str(e)
+                raise
+            item['status'] = 'completed'
+            item.pop('error', None)
+            with jobs_lock:
+                job['processed_videos'] += 1
+
+        def record_failure(item, exc):
+            print(f"Error ingesting video {item['video_id']}: {exc}")
+            item['status'] = 'failed'
+            with jobs_lock:
+                job['processed_videos'] += 1
+
+        run_job_with_backoff(job_id, pending, ingest, record_failure)
+    except Exception as e:
+        # Don't leave the job in progress forever when resolving or looking up videos fails
+        print(f"Bulk ingest {job_id} failed: {e}")
+        job['status'] = 'failed'
+        job['error_class'] = error_class(e)
+        job['error'] = str(e)
+        for item in job['items']:
+            if item['status'] in ('pending', 'in_progress', 'requeued'):
+                item['status'] = 'failed'
+                item.setdefault('error_class', error_class(e))
+                item.setdefault('error', str(e))
+        return
+
+    job['status'] = 'completed'
+
+@ns_transcripts.route('/bulk')
+class BulkIngest(Resource):
+    @api.expect(bulk_ingest_model)
+    @api.response(202, 'Bulk ingestion job started', bulk_job_model)
+    @api.response(400, 'No URLs provided')
+    def post(self):
+        """Ingest many video and playlist URLs as one background job"""
+        data = request.get_json() or {}
+        urls = data.get('urls') or []
+        if not urls:
+            api.abort(400, "Please provide at least one URL.")
+
+        translate = bool(data.get('translate', False))
+        force = bool(data.get('force', False))
+        translation_strategy = data.get('translation_strategy', 'auto')
+        if translation_strategy not in TRANSLATION_STRATEGIES:
+            api.abort(400, f"Unknown translation strategy: {translation_strategy}")
+
+        job_id = create_bulk_ingest_job()
+        threading.Thread(target=process_bulk_ingest, args=(job_id, urls, translate, force, translation_strategy)).start()
+        return jobs[job_id], 202
+
 @app.route('/single_transcript', methods=['GET'])
 def get_single_transcript():
     video_url = request.args.get('url')
     translate = request.args.get('translate', 'false').lower() == 'true'
+    translation_strategy = request.args.get('translation_strategy', 'auto')
     
     if not video_url:
         return jsonify({"error": "Please provide a video URL."}), 400
+    if translation_strategy not in TRANSLATION_STRATEGIES:
+        return jsonify({"error": f"Unknown translation strategy: {translation_strategy}"}), 400
 
-    result, status_code = fetch_single_transcript(video_url, translate)
+    result, status_code = fetch_single_transcript(video_url, translate, translation_strategy)
     return jsonify(result), status_code
 
 @app.route('/download/<video_id>/<type>', methods=['GET'])
 def download_transcript(video_id, type):
     try:
-        cache_dir = os.path.join('storage', 'transcripts', video_id)
-        file_path = os.path.join(cache_dir, f'{type}.txt')
-        
-        if not os.path.exists(file_path):
-            return jsonify({"error": "Transcript not found"}), 404
-            
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        key = f"transcripts/{video_id}/{type}.txt"
+
+        # Pin before resolving, so the file can't be evicted between the check and the read
+        with storage_manager.pinned(storage.cache_path(key)):
+            file_path = storage.local_path(key)
+            if file_path is None:
+                return jsonify({"error": "Transcript not found"}), 404
+
+            storage_manager.record_access(file_path)
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
             
         response = Response(content, mimetype='text/plain')
         response.headers['Content-Disposition'] = f'attachment; filename={video_id}_{type}_transcript.txt'
@@ -632,42 +1282,135 @@ def download_transcript(video_id, type):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Files of a stored transcript that go into exports, audio only on request
+EXPORT_TRANSCRIPT_FILES = ['original.txt', 'translated.txt', 'metadata.json', 'transcript_info.json']
+EXPORT_AUDIO_FILES = ['original_audio.mp3', 'translated_audio.mp3']
+
+def collect_export_entries(channel_name=None, query=None, include_audio=False):
+    """Collect the stored files of a channel's or a search query's videos.
+
+    Videos are matched on the author or title cached in their metadata.json.
+    A channel export also includes the channel's cached transcripts and
+    training data. Entries are sorted so the same files always produce the
+    same archive, which is what makes Range resumes possible.
+    """
+    entries = []
+    file_names = EXPORT_TRANSCRIPT_FILES + (EXPORT_AUDIO_FILES if include_audio else [])
+
+    def entry(name, key, size, mtime):
+        # Bodies are read when the archive streams, not downloaded up front
+        return ArchiveEntry(name, storage.cache_path(key), size, mtime, partial(storage.read_range, key))
+
+    for video_id in storage.list_dirs('transcripts'):
+        stored_files = storage.stat_files(f"transcripts/{video_id}")
+        if 'metadata.json' not in stored_files or 'original.txt' not in stored_files:
+            continue
+
+        metadata = read_json(f"transcripts/{video_id}/metadata.json")
+        if metadata is None:
+            # Deleted or unreadable since it was listed
+            continue
+        if channel_name and metadata.get('author', '').lower() != channel_name.lower():
+            continue
+        if query and query.lower() not in metadata.get('title', '').lower():
+            continue
+
+        for file_name in file_names:
+            if file_name in stored_files:
+                size, mtime = stored_files[file_name]
+                key = f"transcripts/{video_id}/{file_name}"
+                entries.append(entry(key, key, size, mtime))
+
+    if channel_name:
+        for file_name, (size, mtime) in sorted(storage.stat_files(f"cache/{channel_name}").items()):
+            entries.append(entry(f"cache/{file_name}", f"cache/{channel_name}/{file_name}", size, mtime))
+
+    return entries
+
+def export_name(channel_name=None, query=None):
+    """File-system friendly name for an export archive"""
+    name = channel_name or query or 'transcripts'
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', name).strip('_') or 'transcripts'
+
+@app.route('/export', methods=['GET'])
+def export_transcripts():
+    """Stream a channel's or a query's transcripts as a tar or zip archive"""
+    channel_name = request.args.get('channel_name')
+    query = request.args.get('query')
+    archive_format = request.args.get('format', 'tar')
+    include_audio = request.args.get('audio', 'false').lower() == 'true'
+
+    if not channel_name and not query:
+        return jsonify({"error": "Please provide a channel name or a query."}), 400
+    if archive_format not in ('tar', 'zip'):
+        return jsonify({"error": "Format must be tar or zip."}), 400
+
+    try:
+        entries = collect_export_entries(channel_name, query, include_audio)
+        if not entries:
+            return jsonify({"error": "No transcripts found"}), 404
+
+        filename = f"{export_name(channel_name, query)}.{archive_format}"
+        if archive_format == 'zip':
+            response = Response(stream_zip(entries), mimetype='application/zip', direct_passthrough=True)
+            response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+            response.call_on_close(pin_files([entry.path for entry in entries]))
+            return response
+
+        total_size = tar_size(entries)
+        etag = archive_etag(entries)
+
+        # A range is only served when the client proves it holds this exact
+        # archive, otherwise the resumed bytes could belong to a different one
+        if_match = request.headers.get('If-Match')
+        if if_match and if_match.strip() not in ('*', f'"{etag}"'):
+            return Response(status=412, headers={'ETag': f'"{etag}"'})
+        if_range = request.headers.get('If-Range')
+        byte_range = None
+        if if_match or (if_range and if_range.strip() == f'"{etag}"'):
+            try:
+                byte_range = parse_range(request.headers.get('Range'), total_size)
+            except RangeNotSatisfiable:
+                return Response(status=416, headers={'Content-Range': f'bytes */{total_size}'})
+
+        start, end = byte_range or (0, total_size)
+        response = Response(
+            stream_tar(entries, start, end),
+            status=206 if byte_range else 200,
+            mimetype='application/x-tar',
+            direct_passthrough=True
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        response.headers['Content-Length'] = str(end - start)
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['ETag'] = f'"{etag}"'
+        if byte_range:
+            response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{total_size}'
+        response.call_on_close(pin_files([entry.path for entry in entries]))
+        return response
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/transcripts/list')
 def list_transcripts():
     """List all stored transcripts"""
     try:
         transcripts = []
-        storage_dir = os.path.join('storage', 'transcripts')
         
-        if os.path.exists(storage_dir):
-            for video_id in os.listdir(storage_dir):
-                transcript_dir = os.path.join(storage_dir, video_id)
-                if os.path.isdir(transcript_dir):
-                    # Read original transcript metadata
-                    original_path = os.path.join(transcript_dir, 'original.txt')
-                    translated_path = os.path.join(transcript_dir, 'translated.txt')
+        for video_id in storage.list_dirs('transcripts'):
+            stored_files = storage.list_files(f"transcripts/{video_id}")
+            
+            if 'original.txt' in stored_files:
+                # Get video details (cached after the first lookup)
+                title, author = get_video_details(video_id)
                     
-                    if os.path.exists(original_path):
-                        # Get video details from YouTube API
-                        video_response = youtube.videos().list(
-                            part='snippet',
-                            id=video_id
-                        ).execute()
-                        
-                        if video_response['items']:
-                            video_info = video_response['items'][0]['snippet']
-                            title = video_info['title']
-                            author = video_info['channelTitle']
-                        else:
-                            title = "Unknown Title"
-                            author = "Unknown Author"
-                            
-                        transcripts.append({
-                            'video_id': video_id,
-                            'title': title,
-                            'author': author,
-                            'has_translation': os.path.exists(translated_path)
-                        })
+                transcripts.append({
+                    'video_id': video_id,
+                    'title': title,
+                    'author': author,
+                    'has_translation': 'translated.txt' in stored_files
+                })
         
         return render_template('transcripts.html', transcripts=transcripts)
     except Exception as e:
@@ -677,122 +1420,172 @@ def list_transcripts():
 def view_transcript(video_id):
     """View a specific transcript"""
     try:
-        transcript_dir = os.path.join('storage', 'transcripts', video_id)
-        original_path = os.path.join(transcript_dir, 'original.txt')
-        translated_path = os.path.join(transcript_dir, 'translated.txt')
-        original_audio_path = os.path.join(transcript_dir, 'original_audio.mp3')
-        translated_audio_path = os.path.join(transcript_dir, 'translated_audio.mp3')
+        stored_files = storage.list_files(f"transcripts/{video_id}")
         
-        if not os.path.exists(original_path):
+        if 'original.txt' not in stored_files:
             return render_template('transcript_view.html', 
                                  error="Transcript not found")
         
-        # Read the transcript files
-        with open(original_path, 'r', encoding='utf-8') as f:
-            transcript_text = f.read()
-            
-        translated_text = None
-        if os.path.exists(translated_path):
-            with open(translated_path, 'r', encoding='utf-8') as f:
-                translated_text = f.read()
+        # The text itself is loaded in windows by the page, see transcript_content
+        info = read_json(f"transcripts/{video_id}/transcript_info.json") or {}
         
         # Get video details
-        video_response = youtube.videos().list(
-            part='snippet',
-            id=video_id
-        ).execute()
-        
-        if video_response['items']:
-            video_info = video_response['items'][0]['snippet']
-            title = video_info['title']
-            author = video_info['channelTitle']
-        else:
-            title = "Unknown Title"
-            author = "Unknown Author"
+        title, author = get_video_details(video_id)
             
         transcript_data = {
             'video_id': video_id,
             'title': title,
             'author': author,
-            'transcript': transcript_text,
-            'translated_transcript': translated_text,
-            'original_language': 'Unknown',  # You might want to store this in a metadata file
-            'has_original_audio': os.path.exists(original_audio_path),
-            'has_translated_audio': os.path.exists(translated_audio_path)
+            'has_translation': 'translated.txt' in stored_files,
+            'original_language': info.get('original_language', 'Unknown'),
+            'has_original_audio': 'original_audio.mp3' in stored_files,
+            'has_translated_audio': 'translated_audio.mp3' in stored_files
         }
         
         return render_template('transcript_view.html', transcript=transcript_data)
     except Exception as e:
         return render_template('transcript_view.html', error=str(e))
 
-@app.route('/generate_audio/<video_id>/<type>')
-def generate_audio(video_id, type):
+@app.route('/transcripts/content/<video_id>/<type>')
+def transcript_content(video_id, type):
+    """Serve a window of a transcript's text"""
     try:
-        transcript_dir = os.path.join('storage', 'transcripts', video_id)
-        transcript_path = os.path.join(transcript_dir, f'{type}.txt')
-        audio_path = os.path.join(transcript_dir, f'{type}_audio.mp3')
-        
-        # Check if regeneration is requested
-        regenerate = request.args.get('regenerate', 'false').lower() == 'true'
-        
-        if os.path.exists(audio_path) and not regenerate:
-            print(f"Serving cached audio for {video_id}")
-            return send_file(
-                audio_path,
-                mimetype='audio/mpeg',
-                as_attachment=False
-            )
-            
-        if not os.path.exists(transcript_path):
-            return jsonify({"error": "Transcript not found"}), 404
-            
-        with open(transcript_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        # Extract just the transcript part (after the headers)
-        text = content.split('\n\n', 1)[1] if '\n\n' in content else content
-        
-        # Count total paragraphs for progress calculation
-        total_paragraphs = len([p for p in text.split('\n\n') if p.strip()])
-        processed_paragraphs = 0
+        if type not in ('original', 'translated'):
+            return jsonify({"error": "Unknown transcript type"}), 400
+
+        key = f"transcripts/{video_id}/{type}.txt"
+        window = int(request.args.get('window', 0))
+        count = min(int(request.args.get('count', 1)), 20)
+
+        with storage_manager.pinned(storage.cache_path(key)):
+            file_path = storage.local_path(key)
+            if file_path is None:
+                return jsonify({"error": "Transcript not found"}), 404
+
+            storage_manager.record_access(file_path)
+            return jsonify(read_windows(storage, key, window, count))
+
+    except ValueError:
+        return jsonify({"error": "window and count must be integers"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def start_audio_generation(video_id, type):
+    """Start generating a transcript's audio, or return the generation already running.
+
+    Returns None if the transcript doesn't exist.
+    """
+    transcript_key = f"transcripts/{video_id}/{type}.txt"
+    # Generations write to the local tier and are uploaded once complete
+    audio_path = storage.cache_path(f"transcripts/{video_id}/{type}_audio.mp3")
+
+    generation = audio_broadcaster.get(audio_path)
+    if generation is not None:
+        print(f"Attaching to audio generation in progress for {video_id}")
+        return generation
+
+    if not storage.exists(transcript_key):
+        return None
         
-        print(f"Starting audio generation for {video_id} with {total_paragraphs} paragraphs")
+    content = storage.read_text(transcript_key)
         
-        def text_stream():
-            nonlocal processed_paragraphs
-            paragraphs = text.split('\n\n')
-            for paragraph in paragraphs:
-                if paragraph.strip():
-                    processed_paragraphs += 1
-                    progress = (processed_paragraphs / total_paragraphs) * 100
-                    print(f"Processing paragraph {processed_paragraphs}/{total_paragraphs} ({progress:.1f}%)")
-                    yield paragraph.strip() + " "
-
+    # Extract just the transcript part (after the headers)
+    text = content.split('\n\n', 1)[1] if '\n\n' in content else content
+    
+    # Count total paragraphs for progress calculation
+    total_paragraphs = len([p for p in text.split('\n\n') if p.strip()])
+    processed_paragraphs = 0
+    
+    print(f"Starting audio generation for {video_id} with {total_paragraphs} paragraphs")
+    
+    def text_stream():
+        nonlocal processed_paragraphs
+        paragraphs = text.split('\n\n')
+        for paragraph in paragraphs:
+            if paragraph.strip():
+                processed_paragraphs += 1
+                progress = (processed_paragraphs / total_paragraphs) * 100
+                print(f"Processing paragraph {processed_paragraphs}/{total_paragraphs} ({progress:.1f}%)")
+                yield paragraph.strip() + " "
+
+    def audio_stream():
         # Generate audio stream
         print(f"Generating new audio for {video_id}")
-        audio_stream = client.generate(
+        return client.generate(
             text=text_stream(),
             voice=voice_id,
             model="eleven_multilingual_v2",
             stream=True
         )
 
-        # Save the audio file while streaming
-        total_size = 0
-        with open(audio_path, 'wb') as f:
-            for chunk in audio_stream:
-                f.write(chunk)
-                total_size += len(chunk)
-                print(f"Received audio chunk: {len(chunk)} bytes (Total: {total_size} bytes)")
+    # The audio is written to a temp file while it streams and replaces
+    # the cached file once complete
+    os.makedirs(os.path.dirname(audio_path), exist_ok=True)
+    return audio_broadcaster.start(audio_path, audio_stream)
+
+@app.route('/generate_audio/<video_id>/<type>', methods=['POST'])
+def regenerate_audio(video_id, type):
+    """Start a new generation without streaming it.
+
+    The page then plays the plain GET URL, which attaches to the running
+    generation and later serves the cached file. Reloads, replays and Range
+    requests therefore never pay for another generation.
+    """
+    try:
+        generation = start_audio_generation(video_id, type)
+        if generation is None:
+            return jsonify({"error": "Transcript not found"}), 404
+        return jsonify({"status": "generating"}), 202
+        
+    except Exception as e:
+        print(f"Audio generation error: {e}")  # Debug log
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/generate_audio/<video_id>/<type>')
+def generate_audio(video_id, type):
+    try:
+        audio_key = f"transcripts/{video_id}/{type}_audio.mp3"
+        audio_path = storage.cache_path(audio_key)
+        
+        # Check if regeneration is requested
+        regenerate = request.args.get('regenerate', 'false').lower() == 'true'
 
-        print(f"Audio generation complete for {video_id}. Total size: {total_size} bytes")
+        # Listeners of a generation that's already running attach to its stream
+        generation = audio_broadcaster.get(audio_path)
         
-        # Return the saved file
-        return send_file(
-            audio_path,
+        if generation is None and not regenerate:
+            # Pin before checking for the file, so it can't be evicted before it is opened
+            release = pin_files([audio_path])
+            try:
+                if storage.local_path(audio_key) is not None:
+                    print(f"Serving cached audio for {video_id}")
+                    response = send_file(
+                        audio_path,
+                        mimetype='audio/mpeg',
+                        as_attachment=False
+                    )
+                    response.call_on_close(release)
+                    return response
+            except Exception:
+                release()
+                raise
+            release()
+            
+        if generation is None:
+            generation = start_audio_generation(video_id, type)
+            if generation is None:
+                return jsonify({"error": "Transcript not found"}), 404
+        else:
+            print(f"Attaching to audio generation in progress for {video_id}")
+
+        # Forward chunks to the client as they arrive instead of waiting for the whole file
+        response = Response(
+            generation.listen(),
             mimetype='audio/mpeg',
-            as_attachment=False
+            direct_passthrough=True
         )
+        response.call_on_close(pin_files([audio_path]))
+        return response
         
     except Exception as e:
         print(f"Audio generation error: {e}")  # Debug log
@@ -803,25 +1596,26 @@ def cli():
     """CLI for interacting with the Transcript Service."""
     pass
 
-@cli.command()
+@cli.command('fetch-transcripts')
 @click.option('--channel_name', required=True, help='YouTube channel name to fetch transcripts from.')
 @click.option('--author', help='YouTube author name to filter results.')
-def fetch_transcripts(channel_name, author):
+def fetch_transcripts_cmd(channel_name, author):
     """Fetch transcripts for a given YouTube channel."""
     result, status_code = fetch_transcripts(channel_name, author)
     click.echo(result)
 
-@cli.command()
+@cli.command('fetch-single-transcript')
 @click.argument('video_url')
 @click.option('--translate', is_flag=True, default=False, help='Translate the transcript to English.')
-def fetch_single_transcript(video_url, translate):
+@click.option('--translation-strategy', type=click.Choice(list(TRANSLATION_STRATEGIES)), default='auto', help='Which translation tiers to try.')
+def fetch_single_transcript_cmd(video_url, translate, translation_strategy):
     """Fetch a single transcript for a given video URL."""
-    result, status_code = fetch_single_transcript(video_url, translate)
+    result, status_code = fetch_single_transcript(video_url, translate, translation_strategy)
     click.echo(result)
 
-@cli.command()
+@cli.command('check-job-status')
 @click.argument('job_id')
-def check_job_status(job_id):
+def check_job_status_cmd(job_id):
     """Check the status of a transcription job."""
     job_status = jobs.get(job_id)
     if job_status:
@@ -829,5 +1623,69 @@ def check_job_status(job_id):
     else:
         click.echo(f"Job {job_id} not found.")
 
+@cli.command()
+@click.argument('urls', nargs=-1)
+@click.option('--file', 'url_file', type=click.File('r'), help='File with one video or playlist URL per line.')
+@click.option('--translate', is_flag=True, default=False, help='Translate the transcripts to English.')
+@click.option('--force', is_flag=True, default=False, help='Re-fetch videos that are already stored.')
+@click.option('--translation-strategy', type=click.Choice(list(TRANSLATION_STRATEGIES)), default='auto', help='Which translation tiers to try.')
+def ingest(urls, url_file, translate, force, translation_strategy):
+    """Ingest many video or playlist URLs in one job."""
+    urls = list(urls)
+    if url_file:
+        urls.extend(line.strip() for line in url_file if line.strip() and not line.startswith('#'))
+    if not urls:
+        raise click.UsageError("Provide at least one URL or --file.")
+
+    job_id = create_bulk_ingest_job()
+    process_bulk_ingest(job_id, urls, translate, force, translation_strategy)
+    for item in jobs[job_id]['items']:
+        click.echo(f"{item['status']:<10} {item.get('video_id') or item['url']} {item.get('error', '')}")
+
+@cli.command()
+@click.option('--channel_name', help='Export the transcripts of this YouTube channel.')
+@click.option('--query', help='Export the transcripts whose title contains this text.')
+@click.option('--format', 'archive_format', type=click.Choice(['tar', 'zip']), default='tar', help='Archive format.')
+@click.option('--audio', is_flag=True, default=False, help='Include generated audio.')
+@click.option('--output', type=click.File('wb'), default='-', help='Output file, stdout by default.')
+def export(channel_name, query, archive_format, audio, output):
+    """Export transcripts as a tar or zip archive."""
+    if not channel_name and not query:
+        raise click.UsageError("Provide --channel_name or --query.")
+
+    entries = collect_export_entries(channel_name, query, audio)
+    if not entries:
+        raise click.ClickException("No transcripts found.")
+
+    chunks = stream_zip(entries) if archive_format == 'zip' else stream_tar(entries)
+    for chunk in chunks:
+        output.write(chunk)
+
+@cli.command()
+@click.option('--channel_name', required=True, help='YouTube channel username or @handle.')
+@click.option('--dedup-threshold', type=float, default=DEDUP_THRESHOLD, help='Similarity at which a transcript counts as a near-duplicate.')
+def prepare_training_data(channel_name, dedup_threshold):
+    """Write a channel's transcripts to training_data.jsonl, skipping near-duplicates."""
+    summary = prepare_finetuning_data(channel_name, dedup_threshold)
+    if summary is None:
+        raise click.ClickException(f"Could not prepare training data for {channel_name}.")
+    click.echo(summary)
+
+@cli.command()
+@click.option('--channel_name', required=True, help='YouTube channel whose training data to pack.')
+@click.option('--sequence-length', type=int, default=PACK_SEQUENCE_LENGTH, help='Tokens per packed sequence.')
+@click.option('--overlap', type=int, default=PACK_OVERLAP, help='Tokens shared by consecutive windows of a long transcript.')
+def pack(channel_name, sequence_length, overlap):
+    """Pack a channel's training data into fixed-length token sequences."""
+    totals = pack_training_data(channel_name, sequence_length, overlap)
+    if totals is None:
+        raise click.ClickException(f"No training data for {channel_name}.")
+    click.echo(totals)
+
+@cli.command()
+def quota_usage():
+    """Show today's YouTube Data API quota usage."""
+    click.echo(quota.usage())
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
@@ -5,7 +5,11 @@ from dotenv import load_dotenv
 from youtube_transcript_api import YouTubeTranscriptApi
 import os
 import json
+import threading
+import time
+from collections import OrderedDict
 import boto3
+from quota import INTERACTIVE
 # YouTube Data API
 import googleapiclient.discovery
 
@@ -19,34 +23,147 @@ api = Api(api_key=YOUTUBE_DATA_API_KEY)
 
 youtube = googleapiclient.discovery.build(serviceName='youtube', version='v3', developerKey=YOUTUBE_DATA_API_KEY)
 
-def search_yt(query):
+# Results per page, YouTube allows up to 50
+SEARCH_PAGE_SIZE = 10
+
+def search_yt(query, page_token=None, count=SEARCH_PAGE_SIZE):
+    """Fetch one page of video results for a query"""
     try:
-        search_response = api.search_by_keywords(q=query, search_type="video", count=10)
-        print(f"Search response: {search_response}")  # Debug print
+        request_args = {
+            'q': query,
+            'part': 'snippet',
+            'type': 'video',
+            'maxResults': count
+        }
+        if page_token:
+            request_args['pageToken'] = page_token
+        search_response = Search_Response(youtube.search().list(**request_args).execute())
+        print(f"Search for {query!r} returned {len(search_response.search_results)} results")  # Debug print
         return search_response
     except Exception as e:
         print(f"Error in search_yt: {e}")
         return None
 
 def display_yt_results(search_response):
-    if not search_response or not search_response.items:
+    if not search_response or not search_response.search_results:
         print("No search results found")
         return None
 
-    results = []
-    for search_result in search_response.items:
-        result = {
-            'video_id': search_result.id.videoId,
-            'title': search_result.snippet.title,
-            'author': search_result.snippet.channelTitle,
-            'url': f'https://www.youtube.com/watch?v={search_result.id.videoId}'
-        }
-        results.append(result)
-        print(f'Video ID: {result["video_id"]}')
-        print(f'Title: {result["title"]}')
-        print(f'Author: {result["author"]}')
-        print()
-    return results
+    return [search_result.to_dict() for search_result in search_response.search_results]
+
+class SearchService:
+    """Cached, paginated front for search_yt.
+
+    Responses are cached by (query, page token) for `ttl` seconds with LRU
+    eviction beyond `max_entries`, and identical queries that arrive while one
+    is in flight wait for its result instead of making their own call. Quota is
+    only charged for calls that actually reach YouTube.
+    """
+
+    def __init__(self, quota=None, ttl=3600, max_entries=256, search_fn=None):
+        self.quota = quota
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.search_fn = search_fn or search_yt
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _key(self, query, page_token):
+        return (' '.join(query.lower().split()), page_token or '')
+
+    def _get_cached(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, search_response = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return search_response
+
+    def search(self, query, page_token=None, priority=INTERACTIVE):
+        """Get one page of results, from the cache when possible"""
+        return self.search_with_status(query, page_token, priority)[0]
+
+    def search_with_status(self, query, page_token=None, priority=INTERACTIVE):
+        """Get one page of results and whether it came from YouTube.
+
+        Returns (search_response, fetched). `fetched` is only True for the call
+        that actually reached YouTube; cache hits and coalesced callers get False.
+        """
+        key = self._key(query, page_token)
+        with self._lock:
+            search_response = self._get_cached(key)
+            if search_response is not None:
+                self.hits += 1
+                return search_response, False
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                in_flight = self._in_flight[key] = _InFlightSearch()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            with self._lock:
+                self.coalesced += 1
+            return in_flight.wait(), False
+
+        try:
+            if self.quota is not None:
+                self.quota.charge('search.list', priority)
+            search_response = self.search_fn(query, page_token)
+        except Exception as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            in_flight.finish(error=e)
+            raise
+
+        with self._lock:
+            self.misses += 1
+            # Failed searches return None and aren't cached so they can be retried
+            if search_response is not None:
+                self._cache[key] = (time.monotonic() + self.ttl, search_response)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+            self._in_flight.pop(key, None)
+        in_flight.finish(result=search_response)
+        return search_response, True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced
+            }
+
+class _InFlightSearch:
+    __slots__ = ('_event', 'result', 'error')
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._event.set()
+
+    def wait(self):
+        self._event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
 
 '''
 Search Response JSON
@@ -67,17 +184,17 @@ https://developers.google.com/youtube/v3/docs/videos/list#response
 }
 '''
 class Search_Response:
+    __slots__ = ('prev_page_token', 'next_page_token', 'total_results', 'search_results')
+
     def __init__(self, search_response) -> None:
         self.prev_page_token = search_response.get('prevPageToken')
         self.next_page_token = search_response.get('nextPageToken')
+        self.total_results = search_response.get('pageInfo', {}).get('totalResults')
 
         # items element contain list of videos
-        items = search_response.get('items')
+        items = search_response.get('items') or []
 
-        self.search_results = []
-        for item in items:
-            search_result = Search_Result(item)
-            self.search_results.append(search_result)
+        self.search_results = [Search_Result(item) for item in items]
 
 '''
 Search Results JSON
@@ -109,8 +226,19 @@ https://developers.google.com/youtube/v3/docs/search#resource
 }
 '''
 class Search_Result:
+    __slots__ = ('video_id', 'title', 'author', 'description', 'thumbnails')
+
     def __init__(self, search_result) -> None:
         self.video_id=     search_result['id']['videoId']
         self.title=        search_result['snippet']['title']
+        self.author=       search_result['snippet']['channelTitle']
         self.description=  search_result['snippet']['description']
         self.thumbnails=   search_result['snippet']['thumbnails']['default']['url']
+
+    def to_dict(self):
+        return {
+            'video_id': self.video_id,
+            'title': self.title,
+            'author': self.author,
+            'url': f'https://www.youtube.com/watch?v={self.video_id}'
+        }